@@ -1,6 +1,7 @@
 import re
 ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-rm_color = lambda sometext: ansi_escape.sub('', sometext)
+ansi_partial = re.compile(r'\x1B(?:\[[0-?]*[ -/]*)?\Z')
+rm_color = lambda sometext: ansi_escape.sub('', sometext) if '\x1b' in sometext else sometext
 coloring = lambda msg, num: f'\033[{num}m{msg}\033[0m'
 red          = lambda msg: coloring(msg, '00;31')
 green        = lambda msg: coloring(msg, '00;32')
@@ -46,3 +47,34 @@ def set_colors(self, enable=False):
         self.light_blue   = dummy_color
         self.pink         = dummy_color
         self.light_cyan   = dummy_color
+
+class AnsiStripper:
+    """
+    removes escape sequences from a stream of chunks, holding back a sequence split across chunks
+    >>> stripper = AnsiStripper()
+    >>> stripper.feed('plain ') + stripper.feed('\x1b[00;3') + stripper.feed('1mred\x1b[0m') + stripper.flush()
+    'plain red'
+    >>> stripper.feed('b\x1b') + stripper.flush()
+    'b'
+    """
+    def __init__(self):
+        self.pending = ''
+
+    def feed(self, chunk):
+        if self.pending:
+            chunk = self.pending + chunk
+            self.pending = ''
+        if '\x1b' not in chunk:
+            return chunk
+        last_index = chunk.rfind('\x1b')
+        if ansi_partial.match(chunk, last_index):
+            self.pending = chunk[last_index:]
+            chunk = chunk[:last_index]
+        return ansi_escape.sub('', chunk)
+
+    def flush(self):
+        """
+        the held fragment is an escape sequence cut off by the end of the stream, it is dropped
+        """
+        self.pending = ''
+        return ''
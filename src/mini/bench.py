@@ -0,0 +1,200 @@
+"""
+benchmarks for the misc and menu hot paths
+
+python -m mini.bench                                  # run and print
+python -m mini.bench --save bench_baseline.json       # record a baseline
+python -m mini.bench --baseline bench_baseline.json   # exit 1 when a case is slower than baseline by --threshold
+"""
+import os
+import sys
+import time
+import random
+from . import misc
+from . import ansi_colors
+
+BENCH_CASES = {}
+DEFAULT_SIZES = [100, 1000, 10000]
+
+def bench_case(name):
+    """
+    registers case(size, work_dir) which returns (run, prepare), prepare is called untimed before each run
+    """
+    def register(case):
+        BENCH_CASES[name] = case
+        return case
+    return register
+
+def random_ipv4_list(size, seed=0):
+    rand = random.Random(seed)
+    return [f'{rand.randint(0, 300)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}' for i in range(size)]
+
+@bench_case('is_ipv4')
+def bench_is_ipv4(size, work_dir):
+    ip_list = random_ipv4_list(size)
+    return lambda: [misc.is_ipv4(ip) for ip in ip_list], None
+
+@bench_case('is_ipv4_bulk')
+def bench_is_ipv4_bulk(size, work_dir):
+    ip_list = random_ipv4_list(size)
+    return lambda: misc.is_ipv4_bulk(ip_list), None
+
+@bench_case('is_ipv4_with_prefix')
+def bench_is_ipv4_with_prefix(size, work_dir):
+    network_list = [f'{ip}/{i % 33}' for i, ip in enumerate(random_ipv4_list(size))]
+    return lambda: [misc.is_ipv4_with_prefix(network) for network in network_list], None
+
+@bench_case('is_ipv4_route')
+def bench_is_ipv4_route(size, work_dir):
+    ip_list = random_ipv4_list(size)
+    route_list = [f'{ip}/24 via {ip_list[i - 1]}' for i, ip in enumerate(ip_list)]
+    return lambda: [misc.is_ipv4_route(route) for route in route_list], None
+
+@bench_case('is_ip_in_network')
+def bench_is_ip_in_network(size, work_dir):
+    ip_list = [ip for ip in random_ipv4_list(size * 2) if misc.ipv4_to_int(ip) is not None][:size]
+    return lambda: [misc.is_ip_in_network('192.168.128.0/17', ip) for ip in ip_list], None
+
+@bench_case('netmask_to_prefix')
+def bench_netmask_to_prefix(size, work_dir):
+    netmask_list = [misc.NETMASK_LIST[i % 33] for i in range(size)]
+    return lambda: [misc.netmask_to_prefix(netmask) for netmask in netmask_list], None
+
+@bench_case('concat_dict')
+def bench_concat_dict(size, work_dir):
+    dict_list = [{f'key_{i}_{j}': j for j in range(10)} for i in range(size)]
+    return lambda: misc.concat_dict(dict_list), None
+
+@bench_case('rm_color')
+def bench_rm_color(size, work_dir):
+    text_list = [ansi_colors.red(f'line {i}') if i % 2 else f'plain line {i}' for i in range(size)]
+    return lambda: [ansi_colors.rm_color(text) for text in text_list], None
+
+@bench_case('read_lines')
+def bench_read_lines(size, work_dir):
+    file_path = f'{work_dir}/read_lines.txt'
+    misc.open_write(file_path, ''.join(f'line {i} ' + 'x' * 60 + '\n' for i in range(size)))
+    return lambda: misc.read_lines(file_path), None
+
+@bench_case('read_json')
+def bench_read_json(size, work_dir):
+    file_path = f'{work_dir}/read_json.json'
+    misc.write_json(file_path, {f'key_{i}': {'value': i, 'list': [i, str(i)]} for i in range(size)})
+    return lambda: misc.read_json(file_path), None
+
+@bench_case('delete_all_in_dir')
+def bench_delete_all_in_dir(size, work_dir):
+    dir_path = f'{work_dir}/delete_all_in_dir'
+    def prepare():
+        os.makedirs(dir_path, exist_ok=True)
+        for i in range(size):
+            open(f'{dir_path}/{i}', 'w').close()
+    return lambda: misc.delete_all_in_dir(dir_path), prepare
+
+@bench_case('get_only_file_list')
+def bench_get_only_file_list(size, work_dir):
+    dir_path = f'{work_dir}/get_only_file_list'
+    os.makedirs(dir_path, exist_ok=True)
+    for i in range(size):
+        open(f'{dir_path}/{i}', 'w').close()
+    return lambda: misc.get_only_file_list(dir_path), None
+
+@bench_case('getlist')
+def bench_getlist(size, work_dir):
+    from . import menu
+    import io
+    import contextlib
+    item_list = [f'item_{i}' for i in range(size)]
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            menu.getlist(item_list)
+    return run, None
+
+def measure(run, prepare=None, repeat=5):
+    best = None
+    for i in range(repeat):
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run_benchmarks(case_names=None, sizes=None, repeat=5):
+    """
+    returns {case_name: {size: best seconds}}, sizes are json keys so they are strs
+    """
+    import tempfile
+    import shutil
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='mini_bench_')
+    try:
+        for name in case_names or BENCH_CASES:
+            results[name] = {}
+            for size in sizes:
+                size_dir = f'{work_dir}/{name}_{size}'
+                os.makedirs(size_dir)
+                run, prepare = BENCH_CASES[name](size, size_dir)
+                results[name][str(size)] = measure(run, prepare, repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    returns the list of (case_name, size, seconds, baseline_seconds) slower than baseline by more than threshold
+    >>> compare_results({'a': {'10': 1.5, '100': 1.0}}, {'a': {'10': 1.0}}, threshold=0.2)
+    [('a', '10', 1.5, 1.0)]
+    """
+    regressions = []
+    for name, size_results in results.items():
+        for size, seconds in size_results.items():
+            baseline_seconds = baseline.get(name, {}).get(size)
+            if baseline_seconds and seconds > baseline_seconds * (1 + threshold):
+                regressions.append((name, size, seconds, baseline_seconds))
+    return regressions
+
+def print_results(results, baseline=None):
+    for name, size_results in results.items():
+        for size, seconds in size_results.items():
+            line = f'{name:24} {size:>8} {seconds * 1000:10.3f}ms'
+            if baseline and baseline.get(name, {}).get(size):
+                line += f' {seconds / baseline[name][size]:6.2f}x baseline'
+            print(line)
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m mini.bench', description='benchmarks for mini hot paths')
+    parser.add_argument('cases', nargs='*', help=f'case names, all by default: {" ".join(BENCH_CASES)}')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', help='baseline json to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio, 0.2 is 20%%')
+    parser.add_argument('--save', help='write results as a baseline json')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.cases if name not in BENCH_CASES]
+    if unknown:
+        parser.error(f'unknown cases: {unknown}')
+    baseline = None
+    if args.baseline:
+        baseline = misc.read_json(args.baseline)
+        if baseline is False:
+            return 2
+    results = run_benchmarks(args.cases, args.sizes, args.repeat)
+    print_results(results, baseline)
+    if args.save:
+        misc.write_json(args.save, results, atomic=True)
+    if baseline:
+        regressions = compare_results(results, baseline, args.threshold)
+        for name, size, seconds, baseline_seconds in regressions:
+            print(ansi_colors.red(f'regression: {name} size {size}: {seconds * 1000:.3f}ms > {baseline_seconds * 1000:.3f}ms + {args.threshold:.0%}'))
+        if regressions:
+            return 1
+        print(ansi_colors.green('no regression'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
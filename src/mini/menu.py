@@ -1,14 +1,17 @@
-import json
 import sys
+import os
 import re
-from termios import tcflush, TCIFLUSH
-import toml
+from collections.abc import Mapping
 from .ansi_colors import red, green, brown, blue, purple, cyan, white, light_red, light_green, yellow, light_blue, pink, light_cyan
 from . import misc
 
+def flush_stdin():
+    from termios import tcflush, TCIFLUSH
+    tcflush(sys.stdin, TCIFLUSH)
+
 def get_input(expression=r'\w+', message='Please input: ', err_message='invalid value.', default_value=None):
     while True:
-        tcflush(sys.stdin, TCIFLUSH)
+        flush_stdin()
         user_input = input(message)
         if user_input == '' and default_value is not None:
             return default_value
@@ -41,6 +44,7 @@ def get_y_n(message, default=False, color=yellow):
         return default
 
 def getlist(li, color=cyan):
+    lines = []
     item_list = []
     for i, l in enumerate(li):
         index = i+1
@@ -50,17 +54,278 @@ def getlist(li, color=cyan):
             head = str(index)+', '
         pad = 10 - len(l)
         l += ' ' * pad
-        item_list += [head + color(l)]
+        item_list.append(head + color(l))
         if index % 5 == 0:
-            print(' '.join(item_list))
+            lines.append(' '.join(item_list))
             item_list = []
-    print(' '.join(item_list))
+    lines.append(' '.join(item_list))
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 def getvlist(li, color=cyan):
-    for i, l in enumerate(li):
-        print(str(i + 1) + ', ' + color(l))
+    if li:
+        sys.stdout.write(''.join([str(i + 1) + ', ' + color(l) + '\n' for i, l in enumerate(li)]))
+
+def get_terminal_size(default=(80, 24)):
+    try:
+        size = os.get_terminal_size(sys.stdout.fileno())
+        return size.columns, size.lines
+    except (OSError, ValueError, AttributeError):
+        return default
+
+class MenuRenderer:
+    """
+    lays out menu_list once for the terminal size and renders one page at a time into a single write.
+    column width uses the visible length, so entries already colored are padded right.
+    >>> renderer = MenuRenderer(['a', 'bb', 'ccc', 'dd', 'e'], color=lambda s: s, vertical=False, width=24, height=5)
+    >>> renderer.columns, renderer.rows, renderer.page_count()
+    (3, 1, 2)
+    >>> from mini.ansi_colors import rm_color
+    >>> rm_color(renderer.render_page(1)).splitlines()
+    ['4, dd  5, e  ', 'page 2/2  n:next p:prev g<page>:jump']
+    """
+    RESERVED_LINES = 4
+
+    def __init__(self, menu_list, color=cyan, vertical=True, width=None, height=None):
+        from .ansi_colors import rm_color
+        self.menu_list = menu_list
+        self.color = color
+        terminal_width, terminal_height = get_terminal_size()
+        width = width or terminal_width
+        height = height or terminal_height
+        self.num_width = len(str(len(menu_list)))
+        self.item_width = max((len(rm_color(str(item))) for item in menu_list), default=0)
+        cell_width = self.num_width + 2 + self.item_width + 1
+        self.columns = 1 if vertical else max(1, width // cell_width)
+        self.rows = max(1, height - self.RESERVED_LINES)
+        self.page_size = self.columns * self.rows
+
+    def page_count(self):
+        return max(1, -(-len(self.menu_list) // self.page_size))
+
+    def page_of(self, index):
+        return index // self.page_size
+
+    def render_page(self, page):
+        from .ansi_colors import rm_color
+        start = page * self.page_size
+        end = min(start + self.page_size, len(self.menu_list))
+        lines = []
+        cells = []
+        for index in range(start, end):
+            item = str(self.menu_list[index])
+            cell = f'{index + 1:>{self.num_width}}, ' + self.color(item)
+            if self.columns > 1:
+                cell += ' ' * (self.item_width - len(rm_color(item)))
+            cells.append(cell)
+            if len(cells) == self.columns:
+                lines.append(' '.join(cells))
+                cells = []
+        if cells:
+            lines.append(' '.join(cells))
+        if self.page_count() > 1:
+            lines.append(yellow(f'page {page + 1}/{self.page_count()}  n:next p:prev g<page>:jump'))
+        return '\n'.join(lines) + '\n'
+
+    def show(self, page):
+        sys.stdout.write(self.render_page(page))
+        sys.stdout.flush()
+
+def bench_render(count=50000):
+    """
+    compares getlist/getvlist with MenuRenderer, stdout is a line buffered /dev/null like a terminal
+    """
+    import time
+    menu_list = [f'host-{i:05d}' for i in range(count)]
+    original_stdout = sys.stdout
+    results = {}
+    with open(os.devnull, 'w', buffering=1) as devnull:
+        sys.stdout = devnull
+        try:
+            for name, func in [
+                ('getvlist', lambda: getvlist(menu_list))
+                , ('getlist', lambda: getlist(menu_list))
+                , ('MenuRenderer vertical page', lambda: MenuRenderer(menu_list, width=120, height=50).show(0))
+                , ('MenuRenderer columns page', lambda: MenuRenderer(menu_list, vertical=False, width=120, height=50).show(0))
+            ]:
+                start = time.perf_counter()
+                func()
+                results[name] = time.perf_counter() - start
+        finally:
+            sys.stdout = original_stdout
+    print(f'bench_render: {count} entries')
+    for name, sec in results.items():
+        print(f'  {name:28} {sec * 1000:9.3f}ms')
+    return results
+
+class MenuIndex:
+    """
+    substring index over case folded menu entries, built once.
+    every 1 to 3 char gram maps to the entries containing it, longer queries check the entries
+    of their rarest trigram only. prefix matches come first, then menu order.
+    >>> index = MenuIndex(['web-01', 'web-02', 'DB-01', 'cache-web'])
+    >>> index.query('WEB')
+    [0, 1, 3]
+    >>> index.query('b-0')
+    [0, 1, 2]
+    >>> index.query('web-02')
+    [1]
+    >>> index.query('', limit=2)
+    [0, 1]
+    """
+    def __init__(self, menu_list):
+        self.keys = [str(item).casefold() for item in menu_list]
+        self.grams = {}
+        for index, key in enumerate(self.keys):
+            seen = set()
+            for n in (1, 2, 3):
+                for i in range(len(key) - n + 1):
+                    gram = key[i:i + n]
+                    if gram not in seen:
+                        seen.add(gram)
+                        self.grams.setdefault(gram, []).append(index)
+
+    def query(self, text, limit=None):
+        text = text.casefold()
+        if not text:
+            return list(range(len(self.keys)))[:limit]
+        if len(text) <= 3:
+            candidates = self.grams.get(text, [])
+        else:
+            rarest = min((self.grams.get(text[i:i + 3], []) for i in range(len(text) - 2)), key=len)
+            candidates = [index for index in rarest if text in self.keys[index]]
+        keys = self.keys
+        prefixed = [index for index in candidates if keys[index].startswith(text)]
+        if limit is not None and len(prefixed) >= limit:
+            return prefixed[:limit]
+        others = [index for index in candidates if not keys[index].startswith(text)]
+        return (prefixed + others)[:limit]
+
+def read_key(fd):
+    """
+    one keystroke from a cbreak terminal, arrow keys come back as their escape sequence.
+    a multibyte utf-8 character is read up to its last byte, an invalid byte comes back as ''
+    >>> read_fd, write_fd = os.pipe()
+    >>> os.write(write_fd, 'éa'.encode())
+    3
+    >>> read_key(read_fd), read_key(read_fd)
+    ('é', 'a')
+    >>> os.close(read_fd), os.close(write_fd)
+    (None, None)
+    """
+    import select
+    import codecs
+    key = os.read(fd, 1)
+    if key == b'\x1b':
+        while select.select([fd], [], [], 0.05)[0]:
+            key += os.read(fd, 1)
+            if len(key) >= 3:
+                break
+        return key.decode(errors='ignore')
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    char = decoder.decode(key)
+    # the decoder holds the bytes of an unfinished character, at most 4 bytes make one
+    while not char and decoder.getstate()[0] and len(key) < 4:
+        byte = os.read(fd, 1)
+        if not byte:
+            break
+        key += byte
+        char = decoder.decode(byte)
+    return char
+
+def filter_select_keys(menu_list, index, message, limit, color):
+    """
+    type to filter, up/down to move, enter to select, esc to cancel(returns None)
+    """
+    import termios
+    import tty
+    fd = sys.stdin.fileno()
+    old_attr = termios.tcgetattr(fd)
+    query = ''
+    cursor = 0
+    drawn_lines = 0
+    try:
+        tty.setcbreak(fd)
+        while True:
+            matches = index.query(query, limit)
+            cursor = min(cursor, max(len(matches) - 1, 0))
+            lines = [message, yellow('type to filter, up/down to move, enter to select, esc to cancel'), f'filter> {query}']
+            for i, menu_index in enumerate(matches):
+                head = light_cyan('> ') if i == cursor else '  '
+                lines.append(head + color(menu_list[menu_index]))
+            if not matches:
+                lines.append(red('  no match'))
+            # one write per keystroke: move up over the previous frame, clear it and draw the new one
+            frame = (f'\033[{drawn_lines}F' if drawn_lines else '') + '\033[J' + '\n'.join(lines) + '\n'
+            sys.stdout.write(frame)
+            sys.stdout.flush()
+            drawn_lines = len(lines)
+            key = read_key(fd)
+            if key in ('\n', '\r'):
+                if matches:
+                    return matches[cursor]
+            elif key in ('\x7f', '\x08'):
+                query = query[:-1]
+                cursor = 0
+            elif key == '\x1b[A':
+                cursor = max(cursor - 1, 0)
+            elif key == '\x1b[B':
+                cursor = cursor + 1
+            elif key in ('\x1b', '\x04'):
+                return None
+            elif key.isprintable():
+                query += key
+                cursor = 0
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old_attr)
+
+def filter_select_lines(menu_list, index, message, limit, color):
+    """
+    line mode for a non tty stdin: a text narrows the list, a number selects from the shown matches,
+    '/' before digits filters by them, empty input cancels(returns None)
+    """
+    matches = index.query('', limit)
+    while True:
+        print(message)
+        for i, menu_index in enumerate(matches):
+            print(str(i + 1) + ', ' + color(menu_list[menu_index]))
+        user_input = input('filter> ')
+        if user_input == '':
+            return None
+        if user_input.isdigit():
+            num = int(user_input) - 1
+            if 0 <= num < len(matches):
+                return matches[num]
+            print(red('Please input existing number!!'))
+            continue
+        matches = index.query(user_input[1:] if user_input.startswith('/') else user_input, limit)
+        if not matches:
+            print(red('no match'))
+
+def filter_select(menu_list, message=green('Please filter and select.'), limit=20, color=cyan, index=None):
+    """
+    returns the selected index in menu_list or None when canceled
+    """
+    if index is None:
+        index = MenuIndex(menu_list)
+    if sys.stdin.isatty():
+        return filter_select_keys(menu_list, index, message, limit, color)
+    return filter_select_lines(menu_list, index, message, limit, color)
 
-def choose_num(menu_list, message=green('Please select number.'), vertical=True, append_exit=False, append_back=False, color=cyan):
+def choose_num(menu_list, message=green('Please select number.'), vertical=True, append_exit=False, append_back=False, color=cyan, filter_mode=False, filter_limit=20, paged=False):
+    if filter_mode:
+        index = filter_select(menu_list, message, filter_limit, color)
+        if index is None:
+            if append_back:
+                print('Back selected.')
+                return None
+            if append_exit:
+                print('Exit selected.')
+                sys.exit(0)
+            return None
+        print(white('Selected : ') + cyan(menu_list[index]))
+        return index
+    renderer = MenuRenderer(menu_list, color, vertical) if paged else None
+    page = 0
     while True:
         print(message)
         if append_exit and append_back:
@@ -69,12 +334,20 @@ def choose_num(menu_list, message=green('Please select number.'), vertical=True,
             print(yellow('0 or q to exit'))
         elif append_back:
             print(yellow('b to back'))
-        if vertical:
+        if paged:
+            renderer.show(page)
+        elif vertical:
             getvlist(menu_list, color)
         else:
             getlist(menu_list, color)
-        tcflush(sys.stdin, TCIFLUSH)
+        flush_stdin()
         num = input('>> ')
+        if paged and num in ('n', 'p'):
+            page = min(max(page + (1 if num == 'n' else -1), 0), renderer.page_count() - 1)
+            continue
+        if paged and re.match(r'g\d+$', num):
+            page = min(max(int(num[1:]) - 1, 0), renderer.page_count() - 1)
+            continue
         if append_exit and num in ('q', '0'):
             print('Exit selected.')
             sys.exit(0)
@@ -90,9 +363,9 @@ def choose_num(menu_list, message=green('Please select number.'), vertical=True,
             continue
         print(red('Please input number!'))
 
-def select_2nd(entries, message=green('Please select number.'), vertical=True, append_exit=True, append_back=False, color=cyan):
+def select_2nd(entries, message=green('Please select number.'), vertical=True, append_exit=True, append_back=False, color=cyan, filter_mode=False, filter_limit=20, paged=False):
     menu_list = list(map(lambda n: n[0], entries))
-    index = choose_num(menu_list, message=message, vertical=vertical, append_exit=append_exit, append_back=append_back, color=color)
+    index = choose_num(menu_list, message=message, vertical=vertical, append_exit=append_exit, append_back=append_back, color=color, filter_mode=filter_mode, filter_limit=filter_limit, paged=paged)
     if isinstance(index, int):
         if callable(entries[index][1]):
             return entries[index][1]()
@@ -118,61 +391,441 @@ password = 'password'
 sudors = true
 '''
 
+BOOL_VALUE_DICT = {
+    'y': True, 'yes': True, 'true': True, '1': True
+    , 'n': False, 'no': False, 'false': False, '0': False
+}
+
+class FieldRule:
+    """
+    one field of a definition with its pattern compiled, 'exp' and 'expr' are both accepted
+    """
+    DEFAULT_EXP = {
+        'string': r'\w.'
+        , 'int': r'\d+'
+    }
+
+    def __init__(self, name, rule):
+        self.name = name
+        self.type = rule['type']
+        if self.type not in ('string', 'int', 'bool'):
+            raise ValueError(f'invalid type {self.type} for {name}')
+        self.message = rule.get('message', name)
+        exp = rule.get('exp', rule.get('expr', self.DEFAULT_EXP.get(self.type)))
+        self.exp = re.compile(exp) if exp else None
+        self.skip_on = {sk: set(sv) for sk, sv in rule.get('skip_on', {}).items()}
+
+    def is_skipped(self, obj):
+        for sk, sv in self.skip_on.items():
+            if obj.get(sk) in sv:
+                return True
+        return False
+
+    def coerce(self, value):
+        """
+        returns (value, error), error is None when the value is valid
+        """
+        if self.type == 'bool':
+            if isinstance(value, bool):
+                return value, None
+            flag = BOOL_VALUE_DICT.get(str(value).lower())
+            if flag is None:
+                return None, f'{self.name}: not a bool: {value!r}'
+            return flag, None
+        if self.type == 'int' and isinstance(value, int) and not isinstance(value, bool):
+            value_str = str(value)
+        elif isinstance(value, str):
+            value_str = value
+        else:
+            return None, f'{self.name}: not a {self.type}: {value!r}'
+        if not self.exp.match(value_str):
+            return None, f'{self.name}: {value_str!r} doesn\'t match {self.exp.pattern}'
+        if self.type == 'int':
+            try:
+                return int(value_str), None
+            except ValueError:
+                return None, f'{self.name}: not an int: {value_str!r}'
+        return value_str, None
+
+class CompiledDefinition:
+    """
+    input definition compiled once, shared by the interactive get_obj_by_definition and batch validation
+    >>> definition = CompiledDefinition(USER_DEF_TOML_STR)
+    >>> definition.validate({'username': 'root', 'password': 'secret'})
+    ({'username': 'root', 'password': 'secret'}, [])
+    >>> definition.validate({'username': 'alice', 'password': 'p@ss', 'sudoers': 'maybe'})
+    ({'username': 'alice', 'password': 'p@ss'}, ["sudoers: not a bool: 'maybe'"])
+    >>> [errors for num, obj, errors in definition.validate_iter([{'username': 'bob', 'sudoers': 'y'}], {'password': 'password'})]
+    [[]]
+    >>> [errors for num, obj, errors in definition.validate_iter([5, None, {'username': 'bob', 'password': 'x1', 'sudoers': 'n'}])]
+    [['not an object'], ['not an object'], []]
+    """
+    def __init__(self, input_definition):
+        if isinstance(input_definition, str):
+            import toml
+            input_definition = toml.loads(input_definition)
+        self.rules = [FieldRule(k, v) for k, v in input_definition.items() if 'type' in v]
+
+    def validate(self, record, default_values=None):
+        """
+        returns (obj, errors), missing fields take default_values, obj is None when record isn't an object
+        """
+        if not isinstance(record, Mapping):
+            return None, ['not an object']
+        obj = {}
+        errors = []
+        for rule in self.rules:
+            if rule.is_skipped(obj):
+                continue
+            if rule.name in record:
+                value = record[rule.name]
+            elif default_values and rule.name in default_values:
+                value = default_values[rule.name]
+            else:
+                errors.append(f'{rule.name}: required')
+                continue
+            value, error = rule.coerce(value)
+            if error:
+                errors.append(error)
+            else:
+                obj[rule.name] = value
+        return obj, errors
+
+    def validate_iter(self, records, default_values=None):
+        """
+        yields (record_num, obj, errors) one record at a time, record_num starts from 1
+        """
+        for record_num, record in enumerate(records, 1):
+            obj, errors = self.validate(record, default_values)
+            yield record_num, obj, errors
+
+def validate_jsonl(input_definition, file_path, default_values=None):
+    """
+    validates a file of one json object per line, yields (line_num, obj, errors) like validate_iter
+    """
+    import json
+    definition = input_definition if isinstance(input_definition, CompiledDefinition) else CompiledDefinition(input_definition)
+    for line_num, line in enumerate(misc.iter_lines(file_path), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_num, None, [f'invalid json: {e}']
+            continue
+        obj, errors = definition.validate(record, default_values)
+        yield line_num, obj, errors
+
 def get_obj_by_definition(input_definition, default_values, by_toml=False, color=cyan):
     """
     ex) input_definition: ex_user_definition
     ex) default_values: ex_default_user
+    input_definition may also be a CompiledDefinition
     """
+    import toml
     if by_toml:
-        input_definiion = toml.loads(input_definiion)
         default_values = toml.loads(default_values)
+    if isinstance(input_definition, CompiledDefinition):
+        definition = input_definition
+    else:
+        definition = CompiledDefinition(input_definition)
     obj = {}
-    for k, v in input_definition.items():
-        if 'type' in v:
-            v_type = v['type']
-            if 'skip_on' in v:
-                skip = False
-                for sk, sv in v['skip_on'].items():
-                    if obj[sk] in sv:
-                        skip = True
-                if skip:
-                    continue
-            message = k
-            if 'message' in v:
-                message = v['message']
-            if v_type == 'string':
-                exp = r'\w.'
-                if 'exp' in v:
-                    exp = v['exp']
-                if k in default_values:
-                    default_value = default_values[k]
-                    obj[k] = get_input(exp, f'{message}(default={default_value}):', default_value=default_value)
-                else:
-                    obj[k] = get_input(exp, f'{message}:')
-            elif v_type == 'int':
-                exp = r'\d+'
-                if 'exp' in v:
-                    exp = v['exp']
-                if k in default_values:
-                    default_value = default_values[k]
-                    value_str = get_input(exp, f'{message}(default={default_value}):', default_value=default_value)
-                else:
-                    value_str = get_input(exp, f'{message}:')
-                obj[k] = int(value_str)
-            elif v_type == 'bool':
-                if k in default_values:
-                    default_value = default_values[k]
-                    obj[k] = get_y_n(f'{message}(default={default_value}):', default=default_value)
-                else:
-                    obj[k] = get_y_n(f'{message}:')
+    for rule in definition.rules:
+        if rule.is_skipped(obj):
+            continue
+        message = rule.message
+        if rule.name in default_values:
+            default_value = default_values[rule.name]
+            prompt = f'{message}(default={default_value}):'
+        else:
+            default_value = None
+            prompt = f'{message}:'
+        if rule.type == 'bool':
+            if default_value is None:
+                obj[rule.name] = get_y_n(prompt)
+            else:
+                obj[rule.name] = get_y_n(prompt, default=default_value)
+            continue
+        value_str = get_input(rule.exp, prompt, default_value=default_value)
+        obj[rule.name] = int(value_str) if rule.type == 'int' else value_str
     print(color(toml.dumps(obj)))
     if get_y_n('OK?'):
         return obj
     else:
         return None
 
+class SelectionJournal:
+    """
+    selections of every menu_type appended to one jsonl journal, with an index file
+    {menu_type: {title: [offset, length, used_seq]}} so load is one seek and listing opens no selection.
+    superseded records are dropped by compaction once they make up most of the journal.
+    the parsed index is reused while the index file and the journal are unchanged on disk.
+    load only reorders titles in memory, the most recently used order is written with the next append
+    or at exit, so reading never writes.
+    >>> journal = SelectionJournal('/tmp/selection_journal_test')
+    >>> journal.clear()
+    True
+    >>> journal.append('vm', 'first', ['a', 'b'])
+    True
+    >>> journal.append('vm', 'second', ['c'])
+    True
+    >>> journal.load('vm', 'first')
+    ['a', 'b']
+    >>> journal.list_titles('vm')
+    ['first', 'second']
+    >>> SelectionJournal('/tmp/selection_journal_test').load('vm', 'second')
+    ['c']
+    """
+    JOURNAL_NAME = 'selection_journal.jsonl'
+    INDEX_NAME = 'selection_index.json'
+
+    def __init__(self, output_dir='/tmp/plur_history', compact_min_size=64 * 1024, compact_ratio=0.5):
+        self.output_dir = output_dir
+        self.journal_path = f'{output_dir}/{self.JOURNAL_NAME}'
+        self.index_path = f'{output_dir}/{self.INDEX_NAME}'
+        self.compact_min_size = compact_min_size
+        self.compact_ratio = compact_ratio
+        self.index = None
+        self.index_stat = None
+        self.touched = {}
+        self.atexit_registered = False
+
+    def new_index(self):
+        return {'journal_size': 0, 'live_size': 0, 'seq': 0, 'selections': {}}
+
+    def lock(self):
+        return misc.FileLock(self.output_dir, 'selection_journal', ttl=60, timeout=10, poll_interval=0.01)
+
+    def stat_index(self):
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def read_index(self):
+        import json
+        try:
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            journal_size = 0
+        index_stat = self.stat_index()
+        if self.index is not None and index_stat == self.index_stat and journal_size == self.index['journal_size']:
+            return self.index
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = self.new_index()
+        if journal_size < index['journal_size']:
+            # journal replaced or truncated, the offsets are stale
+            index = self.new_index()
+        if journal_size != index['journal_size']:
+            self.replay(index)
+        for menu_type, title in self.touched:
+            self.apply_touch(index, menu_type, title)
+        self.index = index
+        self.index_stat = index_stat
+        return index
+
+    def replay(self, index):
+        """
+        indexes records appended after index['journal_size'], a torn last line is left out
+        """
+        import json
+        offset = index['journal_size']
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    offset += len(line)
+                    continue
+                self.apply(index, record, offset, len(line))
+                offset += len(line)
+        index['journal_size'] = offset
+
+    def apply(self, index, record, offset, length):
+        titles = index['selections'].setdefault(record['menu_type'], {})
+        old = titles.pop(record['title'], None)
+        if old:
+            index['live_size'] -= old[1]
+        if record.get('deleted'):
+            if not titles:
+                del index['selections'][record['menu_type']]
+            return
+        index['seq'] += 1
+        titles[record['title']] = [offset, length, index['seq']]
+        index['live_size'] += length
+
+    def write_index(self):
+        """
+        called under the lock, the pending touches are in self.index and get written with it
+        """
+        result = misc.write_json(self.index_path, self.index, indent=None, atomic=True)
+        if result:
+            self.index_stat = self.stat_index()
+            self.touched.clear()
+        return result
+
+    def write_record(self, record):
+        import json
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode()
+        with self.lock():
+            index = self.read_index()
+            offset = index['journal_size']
+            with open(self.journal_path, 'ab') as f:
+                # drop a torn line left by a crashed writer
+                f.truncate(offset)
+                f.write(line)
+            index['journal_size'] = offset + len(line)
+            self.apply(index, record, offset, len(line))
+            if self.needs_compaction():
+                return self.compact_locked()
+            return self.write_index()
+
+    def append(self, menu_type, title, selected_list):
+        return misc.try_io_func(
+            lambda: self.write_record({'menu_type': menu_type, 'title': title, 'selected_list': selected_list})
+            , f'SelectionJournal.append: path: {self.journal_path}')
+
+    def delete(self, menu_type, title):
+        if title not in self.read_index()['selections'].get(menu_type, {}):
+            return False
+        return misc.try_io_func(
+            lambda: self.write_record({'menu_type': menu_type, 'title': title, 'deleted': True})
+            , f'SelectionJournal.delete: path: {self.journal_path}')
+
+    def has(self, menu_type, title):
+        return title in self.read_index()['selections'].get(menu_type, {})
+
+    def read_at(self, menu_type, title):
+        """
+        returns the record of title or None, the record is checked as a concurrent compaction may have moved it
+        """
+        import json
+        entry = self.read_index()['selections'].get(menu_type, {}).get(title)
+        if not entry:
+            return None
+        with open(self.journal_path, 'rb') as f:
+            f.seek(entry[0])
+            line = f.read(entry[1])
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(record, dict) or record.get('menu_type') != menu_type or record.get('title') != title:
+            return None
+        return record
+
+    def read_record(self, menu_type, title):
+        record = self.read_at(menu_type, title)
+        if record is None and self.has(menu_type, title):
+            # stale offsets, read again while no compaction can run
+            with self.lock():
+                self.index_stat = None
+                record = self.read_at(menu_type, title)
+        return record
+
+    def load(self, menu_type, title, touch=True):
+        """
+        returns the selected_list or None, touch moves the title to the front of list_titles
+        """
+        record = misc.try_io_func(lambda: self.read_record(menu_type, title), f'SelectionJournal.load: path: {self.journal_path}')
+        if not record:
+            return None
+        if touch:
+            self.touch(menu_type, title)
+        return record['selected_list']
+
+    def apply_touch(self, index, menu_type, title):
+        entry = index['selections'].get(menu_type, {}).get(title)
+        if entry:
+            index['seq'] += 1
+            entry[2] = index['seq']
+
+    def touch(self, menu_type, title):
+        """
+        in memory only, save_touches writes them
+        """
+        self.touched.pop((menu_type, title), None)
+        self.touched[(menu_type, title)] = True
+        self.apply_touch(self.index, menu_type, title)
+        if not self.atexit_registered:
+            import atexit
+            atexit.register(self.save_touches)
+            self.atexit_registered = True
+
+    def save_touches_locked(self):
+        with self.lock():
+            self.read_index()
+            return self.write_index()
+
+    def save_touches(self):
+        if not self.touched:
+            return True
+        return misc.try_io_func(self.save_touches_locked, f'SelectionJournal.save_touches: path: {self.index_path}')
+
+    def list_menu_types(self):
+        return sorted(self.read_index()['selections'])
+
+    def list_titles(self, menu_type):
+        """
+        most recently used first
+        """
+        titles = self.read_index()['selections'].get(menu_type, {})
+        return sorted(titles, key=lambda title: -titles[title][2])
+
+    def needs_compaction(self):
+        journal_size = self.index['journal_size']
+        return journal_size >= self.compact_min_size and self.index['live_size'] < journal_size * self.compact_ratio
+
+    def compact_locked(self):
+        index = self.index
+        compacted = self.new_index()
+        entry_list = sorted(
+            ((entry[2], menu_type, title, entry) for menu_type, titles in index['selections'].items() for title, entry in titles.items()))
+        offset = 0
+        with open(self.journal_path, 'rb') as src, misc.open_atomic(self.journal_path, 'wb') as dst:
+            for used_seq, menu_type, title, entry in entry_list:
+                src.seek(entry[0])
+                line = src.read(entry[1])
+                dst.write(line)
+                compacted['selections'].setdefault(menu_type, {})[title] = [offset, len(line), used_seq]
+                offset += len(line)
+        compacted['journal_size'] = offset
+        compacted['live_size'] = offset
+        compacted['seq'] = index['seq']
+        self.index = compacted
+        return self.write_index()
+
+    def compact(self):
+        def func():
+            with self.lock():
+                self.read_index()
+                return self.compact_locked()
+        return misc.try_io_func(func, f'SelectionJournal.compact: path: {self.journal_path}')
+
+    def clear(self):
+        def func():
+            with self.lock():
+                for file_path in (self.journal_path, self.index_path):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                self.index = None
+                self.index_stat = None
+                self.touched.clear()
+            return True
+        return misc.try_io_func(func, f'SelectionJournal.clear: path: {self.journal_path}')
+
 class Selection:
-    def __init__(self, menu_type, output_dir='/tmp/plur_history'):
+    """
+    journal=True stores selections in a SelectionJournal of output_dir, .sel files there stay loadable
+    """
+    def __init__(self, menu_type, output_dir='/tmp/plur_history', journal=False):
         if not menu_type:
             self.error('menu_type is needed')
         self.menu_type= misc.sanitize_to_file_name(menu_type)
@@ -183,6 +836,7 @@ class Selection:
         if not prepare_result:
             self.error(f'couldn\'t prepare dir: {output_dir}')
         self.output_dir = output_dir
+        self.journal = SelectionJournal(output_dir) if journal else None
 
     def error(self, err):
         print('error in menu.Selection', err)
@@ -207,10 +861,36 @@ class Selection:
     def save(self):
         if not self.title:
             self.input_title()
-        misc.open_write(self.create_file_path(), json.dumps(self.selected_list, indent=2), 'w')
+        if self.journal:
+            return self.journal.append(self.menu_type, self.title, self.selected_list)
+        import json
+        return misc.open_write(self.create_file_path(), json.dumps(self.selected_list, indent=2), 'w')
+
+    def list_legacy_titles(self):
+        """
+        titles of the .sel files of menu_type, newest first
+        """
+        header = self.menu_type + '_'
+        entry_list = [entry for entry in os.scandir(self.output_dir)
+            if entry.name.startswith(header) and entry.name.endswith('.sel') and entry.is_file()]
+        entry_list.sort(key=lambda entry: -entry.stat().st_mtime)
+        return [entry.name[len(header):-len('.sel')] for entry in entry_list]
+
+    def list_titles(self):
+        """
+        journal titles most recently used first, then .sel titles not in the journal
+        """
+        title_list = self.journal.list_titles(self.menu_type) if self.journal else []
+        title_set = set(title_list)
+        return title_list + [title for title in self.list_legacy_titles() if title not in title_set]
 
     def load(self, title):
         self.set_title(title)
+        if self.journal:
+            selected_list = self.journal.load(self.menu_type, self.title)
+            if selected_list is not None:
+                self.selected_list = selected_list
+                return
         loaded_json = misc.read_json(self.create_file_path())
         if loaded_json:
             self.selected_list = loaded_json
@@ -2,19 +2,38 @@ import os
 import sys
 import stat
 import re
-import shutil
-import json
-import datetime
-import pprint
-import toml
+import bisect
+import collections
+from collections.abc import Mapping
+import time
+import math
+from array import array
 from mini import ansi_colors
-pp = pprint.PrettyPrinter()
+from mini import pipeline
+# toml, json, shutil, pprint, datetime, threading and the like are imported in the functions using them,
+# so short lived cli apps don't pay for them on import
+
+def __getattr__(name):
+    """
+    PEP 562, module level objects costly to build are created on first access
+    """
+    if name == 'pp':
+        return get_pp()
+    if name == 'dir_reaper':
+        return get_dir_reaper()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def get_pp():
+    if 'pp' not in globals():
+        import pprint
+        globals()['pp'] = pprint.PrettyPrinter()
+    return globals()['pp']
 
 def print_flush(msg):
     print(msg, flush=True)
 
 def prettyprint(data):
-    pp.pprint(data)
+    get_pp().pprint(data)
 
 def sanitize_to_file_name(command):
     return re.sub(r'\s|\.', '_', re.sub('/|:|', '', command))
@@ -23,6 +42,7 @@ def is_file(file_path):
     return os.path.isfile(file_path)
 
 def now():
+    import datetime
     return datetime.datetime.now()
 
 def now_debug():
@@ -67,7 +87,13 @@ def del_indent_lines(string):
 def del_indent(string):
     return '\n'.join(del_indent_lines(string))
 
-def try_io_func(func, f_name):
+io_observers = []
+io_profiler = None
+IO_NAME_EXP = re.compile(r'^([^:]+):\s*(?:\w*path:?\s*)?(.*)$')
+
+def try_io_func(func, f_name, size=None):
+    if io_observers or io_profiler is not None:
+        return try_io_func_observed(func, f_name, size)
     try:
         return func()
     except OSError as e:
@@ -77,6 +103,193 @@ def try_io_func(func, f_name):
         print_flush(ansi_colors.red(f'Exception in {f_name}: {e}'))
         return False
 
+def split_io_name(f_name):
+    """
+    >>> split_io_name('open_read: path: /tmp/a')
+    ('open_read', '/tmp/a')
+    >>> split_io_name('delete_file_path: path /tmp/a')
+    ('delete_file_path', '/tmp/a')
+    >>> split_io_name('write_files_atomic')
+    ('write_files_atomic', '')
+    """
+    m = IO_NAME_EXP.match(f_name)
+    if m:
+        return m[1], m[2]
+    return f_name, ''
+
+def try_io_func_observed(func, f_name, size):
+    outcome = 'ok'
+    result = False
+    start = time.perf_counter()
+    try:
+        if io_profiler is not None:
+            result = io_profiler.runcall(func)
+        else:
+            result = func()
+        return result
+    except OSError as e:
+        outcome = 'OSError'
+        print_flush(ansi_colors.red(f'OSError in {f_name}: {e}'))
+        return False
+    except Exception as e:
+        outcome = 'Exception'
+        print_flush(ansi_colors.red(f'Exception in {f_name}: {e}'))
+        return False
+    finally:
+        duration = time.perf_counter() - start
+        if io_observers:
+            if outcome == 'ok' and result is False:
+                outcome = 'failed'
+            if size is None and isinstance(result, (str, bytes, bytearray)):
+                size = len(result)
+            op, path = split_io_name(f_name)
+            for observer in list(io_observers):
+                observer(op, path, duration, size, outcome)
+
+def add_io_observer(observer):
+    """
+    observer(op, path, duration, size, outcome) is called after each try_io_func.
+    outcome is 'ok', 'failed' (func returned False), 'OSError' or 'Exception', size is None when unknown.
+    """
+    io_observers.append(observer)
+    return observer
+
+def remove_io_observer(observer):
+    if observer in io_observers:
+        io_observers.remove(observer)
+
+class IOHistogram:
+    """
+    counts durations per op in fixed log-scale buckets, 8 per power of two from about 1ns to 1024s,
+    so memory stays constant and p50 / p99 are bucket upper bounds within 12.5% of the exact value
+    >>> histogram = add_io_observer(IOHistogram())
+    >>> open_write('/tmp/io_histogram_test', 'abc')
+    True
+    >>> open_read('/tmp/io_histogram_test')
+    'abc'
+    >>> remove_io_observer(histogram)
+    >>> summary = histogram.summary()
+    >>> summary['open_read']['count'], summary['open_read']['bytes'], summary['open_write']['bytes']
+    (1, 3, 3)
+    >>> histogram = IOHistogram()
+    >>> for i in range(100):
+    ...     histogram('op', '', 0.001 if i < 90 else 0.1, None, 'ok')
+    >>> summary = histogram.summary()['op']
+    >>> 0.001 <= summary['p50'] < 0.001125, 0.1 <= summary['p99'] <= summary['max']
+    (True, True)
+    """
+    MIN_EXP = -30
+    MAX_EXP = 11
+    SUB_BUCKETS = 8
+    BUCKET_COUNT = (MAX_EXP - MIN_EXP) * SUB_BUCKETS
+
+    def __init__(self):
+        self.buckets = {}
+        self.stats = {}
+
+    def bucket_upper_bound(self, index):
+        exp, sub = divmod(index, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * self.SUB_BUCKETS), exp + self.MIN_EXP)
+
+    def __call__(self, op, path, duration, size, outcome):
+        min_exp, sub_buckets, bucket_count = self.MIN_EXP, self.SUB_BUCKETS, self.BUCKET_COUNT
+        buckets = self.buckets.get(op)
+        if buckets is None:
+            buckets = self.buckets[op] = array('Q', bytes(8 * bucket_count))
+            self.stats[op] = {'errors': 0, 'bytes': 0, 'max': 0.0, 'total': 0.0}
+        # frexp splits the duration into the power of two and the sub bucket of the mantissa in [0.5, 1)
+        if duration > 0:
+            mantissa, exp = math.frexp(duration)
+            index = (exp - min_exp) * sub_buckets + int((mantissa - 0.5) * 2 * sub_buckets)
+            if index < 0:
+                index = 0
+            elif index >= bucket_count:
+                index = bucket_count - 1
+        else:
+            index = 0
+        buckets[index] += 1
+        stats = self.stats[op]
+        stats['total'] += duration
+        if duration > stats['max']:
+            stats['max'] = duration
+        if outcome != 'ok':
+            stats['errors'] += 1
+        if size:
+            stats['bytes'] += size
+
+    def percentile(self, op, percent):
+        stats = self.stats[op]
+        rank = (sum(self.buckets[op]) - 1) * percent // 100
+        seen = 0
+        for index, count in enumerate(self.buckets[op]):
+            seen += count
+            if seen > rank:
+                return min(self.bucket_upper_bound(index), stats['max'])
+        return stats['max']
+
+    def summary(self):
+        summary = {}
+        for op, stats in self.stats.items():
+            summary[op] = dict(stats
+                , count=sum(self.buckets[op])
+                , p50=self.percentile(op, 50)
+                , p99=self.percentile(op, 99))
+        return summary
+
+    def print_summary(self):
+        for op, stats in sorted(self.summary().items(), key=lambda item: -item[1]['total']):
+            print_flush(f"{op}: count={stats['count']} errors={stats['errors']} bytes={stats['bytes']}"
+                + f" p50={stats['p50'] * 1000:.3f}ms p99={stats['p99'] * 1000:.3f}ms max={stats['max'] * 1000:.3f}ms")
+
+class IOTraceWriter:
+    """
+    appends one json line per try_io_func call
+    """
+    def __init__(self, file_path):
+        create_dir_if_not_exist(file_path)
+        self.file = open(os.path.expanduser(file_path), 'a')
+
+    def __call__(self, op, path, duration, size, outcome):
+        import json
+        self.file.write(json.dumps({'time': time.time(), 'op': op, 'path': path, 'duration': duration, 'size': size, 'outcome': outcome}) + '\n')
+
+    def close(self):
+        remove_io_observer(self)
+        self.file.close()
+
+class IOProfiler:
+    """
+    toggles cProfile around the funcs run by try_io_func
+    """
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.depth = 0
+
+    def runcall(self, func):
+        # nested try_io_func calls are already inside the outer runcall
+        if self.depth:
+            return func()
+        self.depth += 1
+        try:
+            return self.profile.runcall(func)
+        finally:
+            self.depth -= 1
+
+    def start(self):
+        global io_profiler
+        io_profiler = self
+        return self
+
+    def stop(self):
+        global io_profiler
+        if io_profiler is self:
+            io_profiler = None
+
+    def print_stats(self, sort='cumulative', limit=20):
+        import pstats
+        pstats.Stats(self.profile).sort_stats(sort).print_stats(limit)
+
 class FakeWriter:
     def __init__(self):
         pass
@@ -88,22 +301,172 @@ class FakeWriter:
         pass
 
 class ForkWriter:
-    def __init__(self, file_path=None, write_mode='a'):
+    """
+    background=True queues writes in memory and a daemon thread drains them with writelines,
+    when flush_size chars are queued or every flush_interval seconds.
+    backpressure when max_queue writes are queued:
+        'block': wait for the drain thread
+        'drop': discard the oldest queued write
+        'count': discard the new write
+    discarded writes are counted in dropped_count. flush() waits for the drain, close() also fsyncs.
+    tee is a stream that also receives every write, e.g. sys.__stdout__.
+    strip_ansi=True removes escape sequences from the file side only.
+    install() replaces sys.stdout or sys.stderr with this writer and tees to the replaced stream.
+    >>> for backpressure in ('block', 'drop', 'count'):
+    ...     writer = ForkWriter('/tmp/fork_writer_test.log', 'w', background=True, max_queue=8, backpressure=backpressure)
+    ...     for i in range(1000):
+    ...         writer.write(f'line {i}\\n')
+    ...     writer.close()
+    ...     line_count = len(open('/tmp/fork_writer_test.log').readlines())
+    ...     print(backpressure, line_count + writer.get_stats()['dropped_count'], backpressure != 'block' or line_count)
+    block 1000 1000
+    drop 1000 True
+    count 1000 True
+    """
+    def __init__(self, file_path=None, write_mode='a', background=False, flush_size=65536, flush_interval=1.0, max_queue=1024, backpressure='block', tee=None, strip_ansi=False):
         self.file_path = file_path
+        self.tee = tee
+        self.stripper = ansi_colors.AnsiStripper() if strip_ansi else None
+        self.installed = None
         if file_path:
             create_dir_if_not_exist(file_path)
             self.file = open(os.path.expanduser(file_path), write_mode)
         else:
             self.file = FakeWriter()
+        self.bytes_written = 0
+        self.flush_count = 0
+        self.max_queue_depth = 0
+        self.dropped_count = 0
+        self.thread = None
+        if background:
+            if backpressure not in ('block', 'drop', 'count'):
+                raise ValueError(f'invalid backpressure: {backpressure}')
+            self.flush_size = flush_size
+            self.flush_interval = flush_interval
+            self.max_queue = max_queue
+            self.backpressure = backpressure
+            self.queue = collections.deque()
+            self.queued_bytes = 0
+            import threading
+            self.cond = threading.Condition()
+            self.closing = False
+            self.flush_requested = 0
+            self.flush_done = 0
+            self.thread = threading.Thread(target=self.drain_loop, name=f'ForkWriter:{file_path}', daemon=True)
+            self.thread.start()
 
     def write(self, s):
-        self.file.write(s)
+        if self.tee is not None:
+            self.tee.write(s)
+        if self.stripper is not None:
+            s = self.stripper.feed(s)
+            if not s:
+                return
+        self.write_file(s)
+
+    def write_file(self, s):
+        if self.thread is None:
+            self.file.write(s)
+            self.bytes_written += len(s)
+            return
+        with self.cond:
+            while len(self.queue) >= self.max_queue:
+                if self.backpressure == 'block':
+                    self.cond.notify_all()
+                    self.cond.wait()
+                    continue
+                self.dropped_count += 1
+                if self.backpressure == 'count':
+                    return
+                self.queued_bytes -= len(self.queue.popleft())
+            self.queue.append(s)
+            self.queued_bytes += len(s)
+            if len(self.queue) > self.max_queue_depth:
+                self.max_queue_depth = len(self.queue)
+            if self.queued_bytes >= self.flush_size or len(self.queue) >= self.max_queue:
+                self.cond.notify_all()
+
+    def drain_loop(self):
+        while True:
+            with self.cond:
+                if not (self.closing or self.flush_requested > self.flush_done or self.queued_bytes >= self.flush_size or len(self.queue) >= self.max_queue):
+                    self.cond.wait(self.flush_interval)
+                chunks = list(self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+                requested = self.flush_requested
+                closing = self.closing
+                self.cond.notify_all()
+            if chunks:
+                def func():
+                    self.file.writelines(chunks)
+                    self.file.flush()
+                    return True
+                if try_io_func(func, f'ForkWriter: path: {self.file_path}'):
+                    self.bytes_written += sum(len(chunk) for chunk in chunks)
+                    self.flush_count += 1
+            with self.cond:
+                self.flush_done = requested
+                self.cond.notify_all()
+                if closing and not self.queue:
+                    return
 
     def flush(self):
-        self.file.flush()
+        if self.tee is not None:
+            self.tee.flush()
+        if self.thread is None:
+            self.file.flush()
+            self.flush_count += 1
+            return
+        with self.cond:
+            self.flush_requested += 1
+            target = self.flush_requested
+            self.cond.notify_all()
+            while self.flush_done < target and self.thread.is_alive():
+                self.cond.wait()
+
+    def get_stats(self):
+        return {
+            'bytes_written': self.bytes_written
+            , 'flush_count': self.flush_count
+            , 'max_queue_depth': self.max_queue_depth
+            , 'dropped_count': self.dropped_count
+        }
+
+    def isatty(self):
+        return self.tee is not None and self.tee.isatty()
+
+    def install(self, stream_name='stdout'):
+        if stream_name not in ('stdout', 'stderr'):
+            raise ValueError(f'invalid stream_name: {stream_name}')
+        original = getattr(sys, stream_name)
+        self.installed = (stream_name, original)
+        if self.tee is None:
+            self.tee = original
+        setattr(sys, stream_name, self)
+        return self
+
+    def uninstall(self):
+        if self.installed:
+            stream_name, original = self.installed
+            if getattr(sys, stream_name) is self:
+                setattr(sys, stream_name, original)
+            self.installed = None
 
     def close(self):
+        self.uninstall()
+        if self.stripper is not None:
+            rest = self.stripper.flush()
+            if rest:
+                self.write_file(rest)
+        if self.thread is not None:
+            with self.cond:
+                self.closing = True
+                self.cond.notify_all()
+            self.thread.join()
         self.file.flush()
+        if self.thread is not None and self.file_path:
+            os.fsync(self.file.fileno())
         self.file.close()
 
 def create_dir_if_not_exist(file_path):
@@ -114,6 +477,7 @@ def delete_file_path(file_path):
         if os.path.isfile(file_path) or os.path.islink(file_path):
             os.unlink(file_path)
         elif os.path.isdir(file_path):
+            import shutil
             shutil.rmtree(file_path)
     return try_io_func(func, f'delete_file_path: path {file_path}')
 
@@ -124,7 +488,190 @@ def delete_all_in_dir(dir_path):
             delete_file_path(file_path)
     return try_io_func(func, f'delete_all_in_dir: path {dir_path}')
 
-def prepare_dir(dir_path, clear=False):
+def remove_tree_fast(dir_path):
+    """
+    rmtree using os.scandir entry types, no extra stat per entry
+    """
+    stack = [(dir_path, False)]
+    while stack:
+        path, scanned = stack.pop()
+        if scanned:
+            os.rmdir(path)
+            continue
+        stack.append((path, True))
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                else:
+                    os.unlink(entry.path)
+
+class DirReaper:
+    """
+    deletes trash dirs in a thread pool, one job per trash dir which removes its top level subdirs in parallel.
+    pool threads are joined at interpreter exit, so a reap submitted before exit finishes before the process ends.
+    """
+    def __init__(self, max_workers=4):
+        import threading
+        self.max_workers = max_workers
+        self.executor = None
+        self.cond = threading.Condition()
+        self.pending = 0
+        self.errors = []
+
+    def submit(self, func, *args):
+        with self.cond:
+            if self.executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='DirReaper')
+            self.pending += 1
+        try:
+            self.executor.submit(self.run, func, *args)
+        except RuntimeError:
+            with self.cond:
+                self.pending -= 1
+                self.cond.notify_all()
+            raise
+
+    def run(self, func, *args):
+        try:
+            if try_io_func(lambda: func(*args), f'DirReaper: path {args[0]}') is False:
+                self.errors.append(args[0])
+        finally:
+            with self.cond:
+                self.pending -= 1
+                self.cond.notify_all()
+
+    def reap(self, trash_path):
+        """
+        runs in the calling thread when the interpreter is already shutting down
+        """
+        try:
+            self.submit(self.reap_root, trash_path)
+        except RuntimeError:
+            remove_tree_fast(trash_path)
+
+    def reap_root(self, trash_path):
+        sub_dirs = []
+        with os.scandir(trash_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+        if len(sub_dirs) > 1:
+            self.remove_sub_dirs(sub_dirs)
+        elif sub_dirs:
+            remove_tree_fast(sub_dirs[0])
+        os.rmdir(trash_path)
+
+    def remove_sub_dirs(self, sub_dirs):
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(sub_dirs))) as executor:
+                future_list = [executor.submit(remove_tree_fast, sub_dir_path) for sub_dir_path in sub_dirs]
+                for future in future_list:
+                    future.result()
+        except RuntimeError:
+            # no new threads at interpreter shutdown, finish here
+            for sub_dir_path in sub_dirs:
+                if os.path.lexists(sub_dir_path):
+                    remove_tree_fast(sub_dir_path)
+
+    def count_pending(self):
+        return self.pending
+
+    def wait(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending == 0, timeout)
+
+def get_dir_reaper():
+    if 'dir_reaper' not in globals():
+        globals()['dir_reaper'] = DirReaper()
+    return globals()['dir_reaper']
+
+def is_pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def find_stale_trash(abs_dir_path):
+    """
+    .<name>.trash.<pid>.<hex> siblings of abs_dir_path whose pid is no longer running
+    """
+    header = f'.{os.path.basename(abs_dir_path)}.trash.'
+    stale_list = []
+    with os.scandir(os.path.dirname(abs_dir_path)) as it:
+        for entry in it:
+            if not entry.name.startswith(header) or not entry.is_dir(follow_symlinks=False):
+                continue
+            pid = entry.name[len(header):].split('.')[0]
+            if pid.isdigit() and int(pid) != os.getpid() and not is_pid_alive(int(pid)):
+                stale_list.append(entry.path)
+    return stale_list
+
+def clear_dir_background(dir_path):
+    """
+    renames dir_path aside, recreates it empty and leaves the old tree to dir_reaper.
+    falls back to delete_all_in_dir when the rename fails, e.g. dir_path is a mount point.
+    trash dirs of dir_path left by processes which died before reaping them are reaped as well.
+    a symlink to a dir is kept, its target is what gets cleared.
+    >>> remove_tree_fast('/tmp/clear_dir_test') if os.path.isdir('/tmp/clear_dir_test') else None
+    >>> for i in range(20):
+    ...     os.makedirs(f'/tmp/clear_dir_test/work/sub_{i}/deep')
+    ...     open(f'/tmp/clear_dir_test/work/sub_{i}/deep/file', 'w').close()
+    >>> prepare_dir('/tmp/clear_dir_test/work', clear=True, background=True)
+    >>> os.listdir('/tmp/clear_dir_test/work')
+    []
+    >>> wait_reaping(10)
+    True
+    >>> os.listdir('/tmp/clear_dir_test')
+    ['work']
+    >>> os.makedirs('/tmp/clear_dir_test/real/sub')
+    >>> open_write('/tmp/clear_dir_test/real/sub/file', 'x')
+    True
+    >>> os.symlink('/tmp/clear_dir_test/real', '/tmp/clear_dir_test/link')
+    >>> prepare_dir('/tmp/clear_dir_test/link', clear=True, background=True)
+    >>> os.path.islink('/tmp/clear_dir_test/link'), os.listdir('/tmp/clear_dir_test/link')
+    (True, [])
+    >>> wait_reaping(10)
+    True
+    >>> sorted(os.listdir('/tmp/clear_dir_test'))
+    ['link', 'real', 'work']
+    """
+    def func():
+        # rename the link target, renaming the link would leave the target behind and the link replaced
+        abs_dir_path = os.path.realpath(dir_path)
+        trash_path = f'{os.path.dirname(abs_dir_path)}/.{os.path.basename(abs_dir_path)}.trash.{os.getpid()}.{os.urandom(4).hex()}'
+        for stale_trash_path in find_stale_trash(abs_dir_path):
+            get_dir_reaper().reap(stale_trash_path)
+        mode = stat.S_IMODE(os.stat(abs_dir_path).st_mode)
+        try:
+            os.rename(abs_dir_path, trash_path)
+        except OSError:
+            return delete_all_in_dir(dir_path) is not False
+        os.mkdir(abs_dir_path, mode)
+        os.chmod(abs_dir_path, mode)
+        get_dir_reaper().reap(trash_path)
+        return True
+    return try_io_func(func, f'clear_dir_background: path {dir_path}')
+
+def wait_reaping(timeout=None):
+    return get_dir_reaper().wait(timeout)
+
+def count_reaping():
+    return get_dir_reaper().count_pending()
+
+def clear_dir(dir_path, background=False):
+    if background:
+        return clear_dir_background(dir_path)
+    return delete_all_in_dir(dir_path)
+
+def prepare_dir(dir_path, clear=False, background=False):
     def func():
         if dir_path == '/':
             print_flush(ansi_colors.red('err in prepare_dir: prepare / is not allowed.'))
@@ -132,25 +679,25 @@ def prepare_dir(dir_path, clear=False):
         else:
             if os.path.isdir(dir_path):
                 if clear:
-                    delete_all_in_dir(dir_path)
+                    clear_dir(dir_path, background)
                 else:
                     return
             else:
                 os.makedirs(dir_path)
     return try_io_func(func, f'prepare_dir: path {dir_path}')
 
-def prepare_dir_if_not_exists(dir_path, clear=False):
+def prepare_dir_if_not_exists(dir_path, clear=False, background=False):
     def func():
         if os.path.isdir(dir_path):
             if clear:
-                delete_all_in_dir(dir_path)
+                clear_dir(dir_path, background)
         else:
             os.makedirs(dir_path)
         return True
     return try_io_func(func, f'prepare_dir: path {dir_path}')
 
-def prepare_clean_dir(dir_path):
-    prepare_dir_if_not_exists(dir_path, clear=True)
+def prepare_clean_dir(dir_path, background=False):
+    prepare_dir_if_not_exists(dir_path, clear=True, background=background)
 
 def open_read(file_path):
     def func():
@@ -158,15 +705,110 @@ def open_read(file_path):
             return f.read()
     return try_io_func(func, f'open_read: path: {file_path}')
 
-def open_write(file_path, contents, write_mode='w'):
+def fsync_dir(dir_path):
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def create_temp_for(file_path):
+    """
+    temp file next to file_path, with the mode of an existing file_path so renaming keeps it
+    """
+    dir_path = os.path.dirname(os.path.abspath(file_path))
+    tmp_path = f'{dir_path}/.{os.path.basename(file_path)}.{os.getpid()}.{os.urandom(4).hex()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+    except FileNotFoundError:
+        pass
+    return fd, tmp_path
+
+class AtomicFile:
+    """
+    writes go to a temp file in the same dir which replaces file_path only when the with block succeeds
+    """
+    def __init__(self, file_path, write_mode='w', fsync=True):
+        self.file_path = file_path
+        self.write_mode = write_mode
+        self.fsync = fsync
+        self.file = None
+        self.tmp_path = None
+
+    def __enter__(self):
+        fd, self.tmp_path = create_temp_for(self.file_path)
+        self.file = os.fdopen(fd, self.write_mode)
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            self.file.close()
+            if exc_type is None:
+                os.replace(self.tmp_path, self.file_path)
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.unlink(self.tmp_path)
+        if exc_type is None and self.fsync:
+            fsync_dir(os.path.dirname(os.path.abspath(self.file_path)))
+        return False
+
+def open_atomic(file_path, write_mode='w', fsync=True):
+    return AtomicFile(file_path, write_mode, fsync)
+
+def open_write(file_path, contents, write_mode='w', atomic=False):
     def func():
+        if atomic:
+            if write_mode not in ('w', 'wb'):
+                raise ValueError(f'atomic write needs write_mode w or wb: {write_mode}')
+            with open_atomic(file_path, write_mode) as f:
+                f.write(contents)
+            return True
         with open(file_path, write_mode) as f:
             f.write(contents)
         return True
-    return try_io_func(func, f'open_write: path: {file_path}')
+    return try_io_func(func, f'open_write: path: {file_path}', len(contents))
+
+def write_files_atomic(file_list):
+    """
+    group commit of (path, contents) pairs: all temp files are written first, then fsynced in one pass
+    so their writeback overlaps, renamed into place, then each parent dir is fsynced once
+    """
+    def func():
+        tmp_list = []
+        try:
+            for file_path, contents in file_list:
+                fd, tmp_path = create_temp_for(file_path)
+                tmp_list.append((tmp_path, file_path))
+                with os.fdopen(fd, 'wb' if isinstance(contents, bytes) else 'w') as f:
+                    f.write(contents)
+            for tmp_path, file_path in tmp_list:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            dir_set = set()
+            while tmp_list:
+                tmp_path, file_path = tmp_list.pop()
+                os.replace(tmp_path, file_path)
+                dir_set.add(os.path.dirname(os.path.abspath(file_path)))
+            for dir_path in dir_set:
+                fsync_dir(dir_path)
+        finally:
+            for tmp_path, file_path in tmp_list:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        return True
+    return try_io_func(func, 'write_files_atomic')
 
 def read_toml(file_path):
     def func():
+        import toml
         with open(file_path, 'r') as f:
             translated = toml.load(f)
         return translated
@@ -174,33 +816,424 @@ def read_toml(file_path):
 
 def read_json(file_path):
     def func():
+        import json
         data = open_read(file_path)
         return json.loads(data)
     return try_io_func(func, f'read_json: path: {file_path}')
 
-def write_toml(file_path, contents):
+def write_toml(file_path, contents, atomic=False):
     def func():
+        import toml
+        if atomic:
+            with open_atomic(file_path) as f:
+                toml.dump(contents, f)
+            return True
         return open_write(file_path, toml.dumps(contents))
     return try_io_func(func, f'write_toml: path: {file_path}')
 
-def write_json(file_path, json_contents, indent=2):
+def write_json(file_path, json_contents, indent=2, atomic=False):
+    """
+    atomic=True streams json.dump into a temp file which is fsynced and renamed over file_path
+    >>> write_json('/tmp/write_json_test.json', {'a': 1}, atomic=True)
+    True
+    >>> read_json('/tmp/write_json_test.json')
+    {'a': 1}
+    """
     def func():
+        import json
+        if atomic:
+            with open_atomic(file_path) as f:
+                json.dump(json_contents, f, indent=indent)
+            return True
         return open_write(file_path, json.dumps(json_contents, indent=indent))
     return try_io_func(func, f'write_json: path: {file_path}')
 
+class ConfigCache:
+    """
+    parsed config files keyed by path and (st_mtime_ns, st_size), evicted least recently used
+    past max_entries files or max_bytes of source size. results are deep copies unless copy=False.
+    with sidecar_dir, parsed data is also pickled there so a new process skips parsing an unchanged file.
+    >>> cache = ConfigCache()
+    >>> write_json('/tmp/config_cache_test.json', {'a': [1, 2]})
+    True
+    >>> loaded = cache.read_json('/tmp/config_cache_test.json')
+    >>> loaded['a'].append(3)
+    >>> cache.read_json('/tmp/config_cache_test.json'), cache.hits, cache.misses
+    ({'a': [1, 2]}, 1, 1)
+    """
+    def __init__(self, max_entries=128, max_bytes=16 * 1024 * 1024, sidecar_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sidecar_dir = sidecar_dir
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def sidecar_path(self, file_path):
+        import hashlib
+        digest = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+        return f'{self.sidecar_dir}/{digest}.pickle'
+
+    def read_sidecar(self, file_path, key):
+        import pickle
+        try:
+            with open(self.sidecar_path(file_path), 'rb') as f:
+                sidecar_key, data = pickle.load(f)
+        except Exception:
+            return None
+        if sidecar_key != key:
+            return None
+        return data
+
+    def write_sidecar(self, file_path, key, data):
+        import pickle
+        def func():
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+            sidecar_path = self.sidecar_path(file_path)
+            tmp_path = f'{sidecar_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, sidecar_path)
+            return True
+        return try_io_func(func, f'ConfigCache.write_sidecar: path: {file_path}')
+
+    def load(self, file_path, parse_func, copy=True):
+        st = os.stat(file_path)
+        key = (os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+        cache_key = (key[0], parse_func)
+        cached = self.entries.get(cache_key)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            self.entries.move_to_end(cache_key)
+            data = cached[1]
+        else:
+            self.misses += 1
+            data = None
+            if self.sidecar_dir:
+                data = self.read_sidecar(file_path, key)
+            if data is None:
+                with open(file_path, 'r') as f:
+                    data = parse_func(f)
+                if self.sidecar_dir:
+                    self.write_sidecar(file_path, key, data)
+            if cached is not None:
+                self.total_bytes -= cached[0][2]
+            self.entries[cache_key] = (key, data)
+            self.entries.move_to_end(cache_key)
+            self.total_bytes += st.st_size
+            self.evict_entries()
+        if copy:
+            from copy import deepcopy
+            return deepcopy(data)
+        return data
+
+    def evict_entries(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            cache_key, (key, data) = self.entries.popitem(last=False)
+            self.total_bytes -= key[2]
+
+    def read_json(self, file_path, copy=True):
+        import json
+        return try_io_func(lambda: self.load(file_path, json.load, copy), f'ConfigCache.read_json: path: {file_path}')
+
+    def read_toml(self, file_path, copy=True):
+        import toml
+        return try_io_func(lambda: self.load(file_path, toml.load, copy), f'ConfigCache.read_toml: path: {file_path}')
+
+config_cache = ConfigCache()
+
+def read_json_cached(file_path, copy=True):
+    return config_cache.read_json(file_path, copy)
+
+def read_toml_cached(file_path, copy=True):
+    return config_cache.read_toml(file_path, copy)
+
 def read_lines(file_path):
     def func():
         data = open_read(file_path)
         return re.split('\n', data)
     return try_io_func(func, f'read_lines: path: {file_path}')
 
+def iter_lines(file_path):
+    """
+    lazy read_lines, yields the same items without holding the file in memory.
+    lines are read in batches through try_io_func, a read or decode error is reported like read_lines and ends the iteration
+    """
+    f_name = f'iter_lines: path: {file_path}'
+    f = try_io_func(lambda: open(file_path, 'r'), f_name)
+    if not f:
+        return
+    with f:
+        ends_with_newline = True
+        while True:
+            line_list = try_io_func(lambda: f.readlines(65536), f_name)
+            if line_list is False:
+                return
+            if not line_list:
+                break
+            for line in line_list:
+                ends_with_newline = line.endswith('\n')
+                yield line[:-1] if ends_with_newline else line
+        if ends_with_newline:
+            yield ''
+
+class MappedLines:
+    """
+    mmap-backed line access, only the lines handed out are decoded
+    >>> open_write('/tmp/mapped_lines_test', 'alpha\\nbeta\\ngamma\\ndelta\\n')
+    True
+    >>> with open_mmap_lines('/tmp/mapped_lines_test') as lines:
+    ...     lines.count_lines(), lines.tail(2), list(lines.grep('a$')), list(lines.iter_from(6))
+    (4, ['gamma', 'delta'], ['alpha', 'beta', 'gamma', 'delta'], ['beta', 'gamma', 'delta'])
+    """
+    def __init__(self, file_path, encoding='utf-8'):
+        self.file_path = file_path
+        import mmap
+        self.encoding = encoding
+        self.file = open(file_path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            self.mm = b''
+
+    def __len__(self):
+        return len(self.mm)
+
+    def decode(self, start, end):
+        return self.mm[start:end].decode(self.encoding, errors='replace')
+
+    def line_start(self, offset):
+        return self.mm.rfind(b'\n', 0, offset) + 1
+
+    def iter_from(self, offset=0):
+        mm = self.mm
+        size = len(mm)
+        pos = self.line_start(offset) if offset else 0
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+            yield self.decode(pos, end)
+            pos = end + 1
+
+    def count_lines(self, chunk_size=1 << 20):
+        mm = self.mm
+        size = len(mm)
+        count = 0
+        for pos in range(0, size, chunk_size):
+            count += mm[pos:pos + chunk_size].count(b'\n')
+        if size and mm[size - 1:size] != b'\n':
+            count += 1
+        return count
+
+    def tail(self, line_num):
+        """
+        the last line_num lines of iter_from(), empty lines at the start included
+        >>> open_write('/tmp/mapped_lines_tail_test', '\\na\\n')
+        True
+        >>> with open_mmap_lines('/tmp/mapped_lines_tail_test') as lines:
+        ...     lines.tail(5), list(lines.iter_from())
+        (['', 'a'], ['', 'a'])
+        >>> open_write('/tmp/mapped_lines_tail_test', '\\n\\n')
+        True
+        >>> with open_mmap_lines('/tmp/mapped_lines_tail_test') as lines:
+        ...     lines.tail(3), list(lines.iter_from())
+        (['', ''], ['', ''])
+        >>> open_write('/tmp/mapped_lines_tail_test', '')
+        True
+        >>> with open_mmap_lines('/tmp/mapped_lines_tail_test') as lines:
+        ...     lines.tail(3)
+        []
+        """
+        mm = self.mm
+        end = len(mm)
+        if not end:
+            return []
+        if mm[end - 1:end] == b'\n':
+            end -= 1
+        lines = []
+        while end >= 0 and len(lines) < line_num:
+            start = mm.rfind(b'\n', 0, end) + 1
+            lines.append(self.decode(start, end))
+            end = start - 1
+        lines.reverse()
+        return lines
+
+    def grep(self, pattern):
+        if isinstance(pattern, str):
+            pattern = pattern.encode(self.encoding)
+        exp = re.compile(pattern, re.MULTILINE)
+        mm = self.mm
+        size = len(mm)
+        pos = 0
+        while pos < size:
+            m = exp.search(mm, pos)
+            if not m:
+                return
+            start = self.line_start(m.start())
+            end = mm.find(b'\n', m.end())
+            if end == -1:
+                end = size
+            yield self.decode(start, end)
+            pos = end + 1
+
+    def close(self):
+        if not isinstance(self.mm, bytes):
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def open_mmap_lines(file_path, encoding='utf-8'):
+    return try_io_func(lambda: MappedLines(file_path, encoding), f'open_mmap_lines: path: {file_path}')
+
 def get_only_file_list(dir_path):
     def func():
-        extracted_dir_path = os.path.expanduser(dir_path)
-        only_file_list = [f for f in os.listdir(extracted_dir_path) if os.path.isfile(os.path.join(extracted_dir_path, f))]
-        return only_file_list
+        with os.scandir(os.path.expanduser(dir_path)) as it:
+            return [entry.name for entry in it if entry.is_file()]
     return try_io_func(func, f'get_only_file_list: dir_path: {dir_path}')
 
+class FileFilter:
+    """
+    pattern is a glob on the file name, regex is searched in the path relative to the walked dir.
+    newer_than and older_than are epoch seconds compared with st_mtime.
+    size and mtime checks use the DirEntry stat cache and only stat when one of them is set.
+    """
+    def __init__(self, pattern=None, regex=None, min_size=None, max_size=None, newer_than=None, older_than=None):
+        self.pattern = pattern
+        if pattern:
+            import fnmatch
+            self.pattern_exp = re.compile(fnmatch.translate(pattern))
+        self.regex = re.compile(regex) if isinstance(regex, str) else regex
+        self.min_size = min_size
+        self.max_size = max_size
+        self.newer_than = newer_than
+        self.older_than = older_than
+        self.needs_stat = any(value is not None for value in (min_size, max_size, newer_than, older_than))
+
+    def match(self, entry, rel_path):
+        if self.pattern and not self.pattern_exp.match(entry.name):
+            return False
+        if self.regex and not self.regex.search(rel_path):
+            return False
+        if self.needs_stat:
+            st = entry.stat()
+            if self.min_size is not None and st.st_size < self.min_size:
+                return False
+            if self.max_size is not None and st.st_size > self.max_size:
+                return False
+            if self.newer_than is not None and st.st_mtime <= self.newer_than:
+                return False
+            if self.older_than is not None and st.st_mtime >= self.older_than:
+                return False
+        return True
+
+def scan_dir(dir_path, rel_path, file_filter, symlinks):
+    """
+    yields (False, rel_path) for matched files and (True, path, rel_path) for sub dirs
+    symlinks:
+        'follow_files': list symlinks to files, don't descend into symlinked dirs
+        'follow': also descend into symlinked dirs
+        'skip': ignore symlinks
+    """
+    follow_dirs = symlinks == 'follow'
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if symlinks == 'skip' and entry.is_symlink():
+                continue
+            child_rel_path = f'{rel_path}/{entry.name}' if rel_path else entry.name
+            if entry.is_dir(follow_symlinks=follow_dirs):
+                yield True, entry.path, child_rel_path
+            elif entry.is_file() and file_filter.match(entry, child_rel_path):
+                yield False, child_rel_path
+
+def is_new_dir(dir_path, seen_dirs):
+    """
+    loop guard for symlinks='follow'
+    """
+    st = os.stat(dir_path)
+    key = (st.st_dev, st.st_ino)
+    if key in seen_dirs:
+        return False
+    seen_dirs.add(key)
+    return True
+
+def iter_files(dir_path, recursive=False, max_depth=None, symlinks='follow_files', **filter_kwargs):
+    """
+    lazy get_only_file_list built on os.scandir, yields paths relative to dir_path.
+    max_depth counts sub dir levels below dir_path, filter_kwargs are passed to FileFilter.
+    >>> prepare_dir('/tmp/iter_files_test/sub/deep')
+    >>> write_files_atomic([('/tmp/iter_files_test/a.txt', 'a'), ('/tmp/iter_files_test/sub/b.txt', 'bb'), ('/tmp/iter_files_test/sub/deep/c.log', 'c')])
+    True
+    >>> sorted(iter_files('/tmp/iter_files_test', recursive=True))
+    ['a.txt', 'sub/b.txt', 'sub/deep/c.log']
+    >>> sorted(iter_files('/tmp/iter_files_test', recursive=True, max_depth=1, pattern='*.txt'))
+    ['a.txt', 'sub/b.txt']
+    >>> sorted(iter_files_parallel('/tmp/iter_files_test', min_size=2))
+    ['sub/b.txt']
+    """
+    if symlinks not in ('follow_files', 'follow', 'skip'):
+        raise ValueError(f'invalid symlinks: {symlinks}')
+    file_filter = FileFilter(**filter_kwargs)
+    root = os.path.expanduser(dir_path)
+    seen_dirs = set()
+    if symlinks == 'follow':
+        is_new_dir(root, seen_dirs)
+    stack = [(root, '', 0)]
+    while stack:
+        path, rel_path, depth = stack.pop()
+        sub_dirs = []
+        try:
+            for found in scan_dir(path, rel_path, file_filter, symlinks):
+                if found[0]:
+                    sub_dirs.append(found[1:])
+                else:
+                    yield found[1]
+        except OSError as e:
+            print_flush(ansi_colors.red(f'OSError in iter_files: path: {path}: {e}'))
+        if recursive and (max_depth is None or depth < max_depth):
+            for sub_dir_path, sub_rel_path in reversed(sub_dirs):
+                if symlinks != 'follow' or is_new_dir(sub_dir_path, seen_dirs):
+                    stack.append((sub_dir_path, sub_rel_path, depth + 1))
+
+def iter_files_parallel(dir_path, max_workers=8, max_depth=None, symlinks='follow_files', **filter_kwargs):
+    """
+    recursive iter_files scanning sub dirs in a thread pool, order of results is not stable.
+    helps on network filesystems where each scandir waits on a round trip.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    if symlinks not in ('follow_files', 'follow', 'skip'):
+        raise ValueError(f'invalid symlinks: {symlinks}')
+    file_filter = FileFilter(**filter_kwargs)
+    root = os.path.expanduser(dir_path)
+    seen_dirs = set()
+    if symlinks == 'follow':
+        is_new_dir(root, seen_dirs)
+    def scan(path, rel_path):
+        return try_io_func(lambda: list(scan_dir(path, rel_path, file_filter, symlinks)), f'iter_files_parallel: path: {path}') or []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scan, root, ''): 0}
+        while futures:
+            done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                depth = futures.pop(future)
+                for found in future.result():
+                    if not found[0]:
+                        yield found[1]
+                    elif max_depth is None or depth < max_depth:
+                        if symlinks != 'follow' or is_new_dir(found[1], seen_dirs):
+                            futures[executor.submit(scan, found[1], found[2])] = depth + 1
+
 def create_log_params(each_task_name, log_base_params, append=False):
     log_parent_dir = log_base_params['log_parent_dir']
     task_name      = log_base_params['task_name']
@@ -225,6 +1258,7 @@ def create_log_params(each_task_name, log_base_params, append=False):
     }
 
 def is_locked(lock_dir_path, fname_header, delta_second=300):
+    import datetime
     if not os.path.exists(lock_dir_path):
         return False
     allow_delta = datetime.timedelta(seconds=delta_second)
@@ -256,6 +1290,7 @@ def create_lock(lock_dir_path, fname_header, timestamp=None):
     """
     fname ex) test_20200101_120030
     """
+    import datetime
     os.makedirs(lock_dir_path, exist_ok=True)
     if not timestamp:
         timestamp = datetime.datetime.now()
@@ -264,6 +1299,7 @@ def create_lock(lock_dir_path, fname_header, timestamp=None):
         f.write('lock')
 
 def test_lock():
+    import datetime
     locktest_dir = '/tmp/locktest'
     fname_header = 'locktest'
     now = datetime.datetime.now()
@@ -277,6 +1313,190 @@ def test_lock():
 
     print_flush(is_locked(locktest_dir, fname_header))
 
+class FileLock:
+    """
+    one lock file per fname_header, created with O_CREAT|O_EXCL, so checking and taking the lock is a single
+    atomic step and never scans lock_dir_path. the file mtime is the lock timestamp and a lock older than ttl
+    seconds is broken by the next acquirer, under flock so only one of them can take it over.
+    >>> lock = FileLock('/tmp/locktest', 'doctest_file_lock', ttl=60)
+    >>> lock.try_acquire()
+    True
+    >>> FileLock('/tmp/locktest', 'doctest_file_lock').try_acquire()
+    False
+    >>> lock.release()
+    True
+    >>> with FileLock('/tmp/locktest', 'doctest_file_lock', timeout=1) as locked:
+    ...     locked.is_locked()
+    True
+    """
+    def __init__(self, lock_dir_path, fname_header, ttl=300, timeout=None, poll_interval=0.1):
+        self.lock_dir_path = lock_dir_path
+        self.lock_file_path = f'{lock_dir_path}/{fname_header}.lock'
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.token = None
+
+    def is_expired(self, st):
+        return time.time() - st.st_mtime >= self.ttl
+
+    def is_locked(self):
+        try:
+            st = os.stat(self.lock_file_path)
+        except FileNotFoundError:
+            return False
+        return not self.is_expired(st)
+
+    def break_if_expired(self):
+        import fcntl
+        try:
+            fd = os.open(self.lock_file_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                path_st = os.stat(self.lock_file_path)
+            except FileNotFoundError:
+                return True
+            if path_st.st_ino != os.fstat(fd).st_ino:
+                # replaced by another acquirer meanwhile
+                return True
+            if not self.is_expired(path_st):
+                return False
+            os.unlink(self.lock_file_path)
+            return True
+        finally:
+            os.close(fd)
+
+    def try_acquire(self):
+        os.makedirs(self.lock_dir_path, exist_ok=True)
+        token = f'{os.getpid()} {os.urandom(8).hex()}'
+        for attempt in range(2):
+            try:
+                fd = os.open(self.lock_file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if attempt == 0 and self.break_if_expired():
+                    continue
+                return False
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            self.token = token
+            return True
+        return False
+
+    def acquire(self, blocking=True, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire():
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                print_flush(ansi_colors.red(f'operation is locked: {self.lock_file_path}'))
+                return False
+            time.sleep(self.poll_interval)
+
+    def refresh(self):
+        if self.token:
+            os.utime(self.lock_file_path)
+
+    def release(self):
+        if not self.token:
+            return False
+        token = self.token
+        self.token = None
+        try:
+            with open(self.lock_file_path, 'r') as f:
+                if f.read() != token:
+                    return False
+            os.unlink(self.lock_file_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def __enter__(self):
+        if not self.acquire():
+            raise TimeoutError(f'couldn\'t acquire lock: {self.lock_file_path}')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+def file_lock_worker(lock_dir_path, counter_path, count):
+    for i in range(count):
+        with FileLock(lock_dir_path, 'contention', poll_interval=0.001):
+            with open(counter_path, 'r') as f:
+                value = int(f.read())
+            with open(counter_path, 'w') as f:
+                f.write(str(value + 1))
+
+def test_file_lock(process_num=4, count=200):
+    import multiprocessing
+    locktest_dir = '/tmp/locktest'
+    counter_path = f'{locktest_dir}/contention_counter'
+    os.makedirs(locktest_dir, exist_ok=True)
+    open_write(counter_path, '0')
+    processes = [multiprocessing.Process(target=file_lock_worker, args=(locktest_dir, counter_path, count)) for i in range(process_num)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    result = int(open_read(counter_path))
+    ok = result == process_num * count
+    print_flush((ansi_colors.green if ok else ansi_colors.red)(f'test_file_lock: counter {result} expected {process_num * count}'))
+    return ok
+
+IMPORT_BUDGET_US = {
+    'mini.misc': 25000
+    , 'mini.menu': 5000
+}
+LAZY_IMPORT_MODULES = ['toml', 'json', 'shutil', 'pprint', 'datetime', 'threading', 'termios', 'mmap', 'fcntl', 'base64']
+
+def test_import_time(budget_us=None, repeat=3):
+    """
+    imports mini.misc and mini.menu in fresh interpreters with -X importtime, fails when the best cumulative
+    time of a module exceeds its budget in microseconds or a module meant to be lazy is imported
+    """
+    import subprocess
+    if budget_us is None:
+        budget_us = IMPORT_BUDGET_US
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = src_dir + os.pathsep + env.get('PYTHONPATH', '')
+    code = 'import sys, mini.misc, mini.menu; print(" ".join(sorted(sys.modules)))'
+    best = {}
+    loaded = set()
+    # first run only writes bytecode caches
+    for i in range(repeat + 1):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            print_flush(ansi_colors.red(f'test_import_time: import failed: {result.stderr}'))
+            return False
+        if i == 0:
+            continue
+        loaded = set(result.stdout.split())
+        for line in result.stderr.splitlines():
+            sp = line.split('|')
+            if len(sp) == 3 and sp[2].strip() in budget_us:
+                name = sp[2].strip()
+                cumulative = int(sp[1])
+                best[name] = min(best.get(name, cumulative), cumulative)
+    ok = True
+    for name, budget in budget_us.items():
+        passed = best.get(name, 0) <= budget
+        ok = ok and passed
+        print_flush((ansi_colors.green if passed else ansi_colors.red)(f'test_import_time: {name} {best.get(name)}us budget {budget}us'))
+    eager = [name for name in LAZY_IMPORT_MODULES if name in loaded]
+    if eager:
+        ok = False
+        print_flush(ansi_colors.red(f'test_import_time: imported eagerly: {eager}'))
+    return ok
+
 mask_list = [
     '0',  # 0
     '128',  # 1
@@ -298,17 +1518,217 @@ NETMASK_EXP_STR = '(' + EXP_255_255_255_X + '|' + EXP_255_255_X_0 + '|' + EXP_25
 IPV4_WITH_PREFIX_EXP_STR = IPV4_EXP_STR + '/(1[0-9]|2[0-9]|3[0-2]|[0-9])'
 IPV4_ROUTE_EXP_STR = IPV4_WITH_PREFIX_EXP_STR + ' via ' + IPV4_EXP_STR
 
+IPV4_EXP = re.compile('^' + IPV4_EXP_STR + '$')
+IPV4_WITH_PREFIX_EXP = re.compile('^' + IPV4_WITH_PREFIX_EXP_STR + '$')
+IPV4_ROUTE_EXP = re.compile('^' + IPV4_ROUTE_EXP_STR + '$')
+IPV4_ROUTE_LIST_EXP = re.compile('^' + IPV4_ROUTE_EXP_STR + r'(\n' + IPV4_ROUTE_EXP_STR + r')*\n?$')
+OCTET_VALUE_DICT = {str(i): i for i in range(256)}
+OCTET_SET = frozenset(OCTET_VALUE_DICT)
+PREFIX_VALUE_DICT = {str(i): i for i in range(33)}
+
 def is_ipv4(may_ipv4_str):
-    return re.search('^' + IPV4_EXP_STR + '$', may_ipv4_str)
+    return IPV4_EXP.search(may_ipv4_str)
 
 def is_ipv4_with_prefix(may_ipv4_with_prefix_str):
-    return re.search('^' + IPV4_WITH_PREFIX_EXP_STR + '$', may_ipv4_with_prefix_str)
+    return IPV4_WITH_PREFIX_EXP.search(may_ipv4_with_prefix_str)
 
 def is_ipv4_route(may_ipv4_route_str):
-    return re.search('^' + IPV4_ROUTE_EXP_STR + '$', may_ipv4_route_str)
+    return IPV4_ROUTE_EXP.search(may_ipv4_route_str)
 
 def is_ipv4_route_list(may_ipv4_route_list_str):
-    return re.search('^' + IPV4_ROUTE_EXP_STR + r'(\n' + IPV4_ROUTE_EXP_STR + r')*\n?$', may_ipv4_route_list_str)
+    return IPV4_ROUTE_LIST_EXP.search(may_ipv4_route_list_str)
+
+def ipv4_to_int(may_ipv4_str):
+    """
+    octets are looked up in OCTET_VALUE_DICT, so leading zeros and spaces are rejected like IPV4_EXP_STR
+    >>> ipv4_to_int('192.168.0.1')
+    3232235521
+    >>> ipv4_to_int('0.0.0.0')
+    0
+    >>> ipv4_to_int('192.168.0.01') is None
+    True
+    >>> ipv4_to_int('192.168.0.256') is None
+    True
+    """
+    sp = may_ipv4_str.split('.')
+    if len(sp) != 4:
+        return None
+    get = OCTET_VALUE_DICT.get
+    a, b, c, d = get(sp[0]), get(sp[1]), get(sp[2]), get(sp[3])
+    if a is None or b is None or c is None or d is None:
+        return None
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+def int_to_ipv4(ip_int):
+    """
+    >>> int_to_ipv4(3232235521)
+    '192.168.0.1'
+    """
+    return f'{ip_int >> 24 & 255}.{ip_int >> 16 & 255}.{ip_int >> 8 & 255}.{ip_int & 255}'
+
+def ipv4_with_prefix_to_int(may_ipv4_with_prefix_str):
+    """
+    >>> ipv4_with_prefix_to_int('192.168.0.0/24')
+    (3232235520, 24)
+    >>> ipv4_with_prefix_to_int('192.168.0.0/33') is None
+    True
+    """
+    ip_str, sep, prefix_str = may_ipv4_with_prefix_str.partition('/')
+    prefix = PREFIX_VALUE_DICT.get(prefix_str)
+    if prefix is None:
+        return None
+    ip_int = ipv4_to_int(ip_str)
+    if ip_int is None:
+        return None
+    return ip_int, prefix
+
+def ipv4_route_to_int(may_ipv4_route_str):
+    """
+    >>> ipv4_route_to_int('10.0.0.0/8 via 192.168.0.1')
+    (167772160, 8, 3232235521)
+    >>> ipv4_route_to_int('10.0.0.0/8  via 192.168.0.1') is None
+    True
+    """
+    network_str, sep, gateway_str = may_ipv4_route_str.partition(' via ')
+    if not sep:
+        return None
+    network = ipv4_with_prefix_to_int(network_str)
+    if network is None:
+        return None
+    gateway_int = ipv4_to_int(gateway_str)
+    if gateway_int is None:
+        return None
+    return network[0], network[1], gateway_int
+
+def to_bitmap(bool_list):
+    """
+    bit i of the returned int is set when bool_list[i] is True
+    >>> bin(to_bitmap([True, False, True, True]))
+    '0b1101'
+    """
+    bits = bytearray((len(bool_list) + 7) // 8)
+    for i, flag in enumerate(bool_list):
+        if flag:
+            bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+def bulk_check(parse_func, may_str_iter, bitmap=False):
+    results = [parse_func(may_str) is not None for may_str in may_str_iter]
+    if bitmap:
+        return to_bitmap(results)
+    return results
+
+def is_ipv4_bulk(may_ipv4_iter, bitmap=False):
+    """
+    >>> is_ipv4_bulk(['192.168.0.1', '192.168.0.256', '10.0.0.1'])
+    [True, False, True]
+    >>> bin(is_ipv4_bulk(['192.168.0.1', '192.168.0.256', '10.0.0.1'], bitmap=True))
+    '0b101'
+    """
+    octets = OCTET_SET
+    results = []
+    append = results.append
+    for may_ipv4 in may_ipv4_iter:
+        sp = may_ipv4.split('.')
+        append(len(sp) == 4 and sp[0] in octets and sp[1] in octets and sp[2] in octets and sp[3] in octets)
+    if bitmap:
+        return to_bitmap(results)
+    return results
+
+def is_ipv4_with_prefix_bulk(may_ipv4_with_prefix_iter, bitmap=False):
+    """
+    >>> is_ipv4_with_prefix_bulk(['192.168.0.0/24', '192.168.0.0/024'])
+    [True, False]
+    """
+    return bulk_check(ipv4_with_prefix_to_int, may_ipv4_with_prefix_iter, bitmap)
+
+def is_ipv4_route_bulk(may_ipv4_route_iter, bitmap=False):
+    """
+    >>> is_ipv4_route_bulk(['0.0.0.0/0 via 10.0.0.1', '0.0.0.0/0 via 10.0.0'])
+    [True, False]
+    """
+    return bulk_check(ipv4_route_to_int, may_ipv4_route_iter, bitmap)
+
+IPv4Route = collections.namedtuple('IPv4Route', ['network_int', 'prefix', 'gateway_int'])
+
+def iter_ipv4_routes(route_lines, invalid_lines=None):
+    """
+    parses 'network/prefix via gateway' lines one at a time, blank lines are skipped.
+    1-based numbers of invalid lines are appended to invalid_lines when given.
+    >>> invalid = []
+    >>> list(iter_ipv4_routes(['10.0.0.0/8 via 192.168.0.1\\n', '10.0.0.0/8 via', '', '0.0.0.0/0 via 10.0.0.1'], invalid))
+    [IPv4Route(network_int=167772160, prefix=8, gateway_int=3232235521), IPv4Route(network_int=0, prefix=0, gateway_int=167772161)]
+    >>> invalid
+    [2]
+    """
+    for line_num, line in enumerate(route_lines, 1):
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        route = ipv4_route_to_int(line)
+        if route is None:
+            if invalid_lines is not None:
+                invalid_lines.append(line_num)
+            continue
+        yield IPv4Route(*route)
+
+def read_ipv4_routes(file_path, invalid_lines=None):
+    f = try_io_func(lambda: open(file_path, 'r'), f'read_ipv4_routes: path: {file_path}')
+    if not f:
+        return
+    with f:
+        yield from iter_ipv4_routes(f, invalid_lines)
+
+def bench_try_io_func(count=1000000):
+    """
+    overhead of try_io_func without observers, which should stay near a plain call
+    """
+    func = lambda: True
+    start = time.perf_counter()
+    for i in range(count):
+        func()
+    plain_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(count):
+        try_io_func(func, 'bench')
+    no_observer_sec = time.perf_counter() - start
+    histogram = add_io_observer(IOHistogram())
+    start = time.perf_counter()
+    for i in range(count):
+        try_io_func(func, 'bench')
+    observed_sec = time.perf_counter() - start
+    remove_io_observer(histogram)
+    print_flush(f'bench_try_io_func: {count} calls')
+    print_flush(f'  plain call:           {plain_sec:.3f}s')
+    print_flush(f'  try_io_func:          {no_observer_sec:.3f}s ({(no_observer_sec - plain_sec) / count * 1e9:.0f}ns/call)')
+    print_flush(f'  with IOHistogram:     {observed_sec:.3f}s ({(observed_sec - plain_sec) / count * 1e9:.0f}ns/call)')
+    return {'plain': plain_sec, 'no_observer': no_observer_sec, 'observed': observed_sec}
+
+def bench_ipv4(count=1000000):
+    import random
+    rand = random.Random(0)
+    samples = []
+    for i in range(count):
+        if i % 4 == 0:
+            samples.append(f'{rand.randint(0, 300)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.0{rand.randint(0, 9)}')
+        else:
+            samples.append(f'{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}')
+    start = time.perf_counter()
+    expected = [bool(re.search('^' + IPV4_EXP_STR + '$', s)) for s in samples]
+    regex_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = [bool(is_ipv4(s)) for s in samples]
+    compiled_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    bulk = is_ipv4_bulk(samples)
+    bulk_sec = time.perf_counter() - start
+    if not expected == compiled == bulk:
+        print_flush(ansi_colors.red('bench_ipv4: results differ'))
+    print_flush(f'bench_ipv4: {count} inputs')
+    print_flush(f'  re.search per call: {regex_sec:.3f}s')
+    print_flush(f'  compiled is_ipv4:   {compiled_sec:.3f}s')
+    print_flush(f'  is_ipv4_bulk:       {bulk_sec:.3f}s')
+    return {'regex': regex_sec, 'compiled': compiled_sec, 'bulk': bulk_sec}
 
 def is_ip_in_network(network, ip):
     """
@@ -318,12 +1738,16 @@ def is_ip_in_network(network, ip):
     True
     >>> is_ip_in_network('192.168.128.0/22', '192.168.132.1')
     False
+    >>> is_ip_in_network('192.168.0.1/32', '192.168.0.1')
+    True
 
     """
     sp = network.split('/')
     net_ip = sp[0]
     prefix_num = int(sp[1])
     quo, rem = prefix_num // 8, prefix_num % 8
+    if quo == 4:
+        return ip == net_ip
     if quo > 0:
         start_octs = '.'.join(net_ip.split('.')[:quo]) + '.'
         if not ip.startswith(start_octs):
@@ -337,6 +1761,99 @@ def is_ip_in_network(network, ip):
         return True
     return False
 
+def prefix_to_mask_int(prefix_num):
+    """
+    >>> hex(prefix_to_mask_int(20))
+    '0xfffff000'
+    """
+    return (0xffffffff << (32 - prefix_num)) & 0xffffffff
+
+class NetworkIndex:
+    """
+    networks are stored as sorted [start, end] int intervals with a parent pointer to the enclosing network,
+    so a lookup is one bisect plus a walk up at most 32 parents.
+    host bits of a network are masked, i.e. '192.168.1.5/24' is indexed as 192.168.1.0/24.
+    >>> index = NetworkIndex(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '192.168.0.0/16'])
+    >>> index.longest_prefix_match('10.1.2.3')
+    '10.1.2.0/24'
+    >>> index.longest_prefix_match('10.2.0.1')
+    '10.0.0.0/8'
+    >>> index.containing_networks('10.1.9.9')
+    ['10.1.0.0/16', '10.0.0.0/8']
+    >>> index.longest_prefix_match('172.16.0.1') is None
+    True
+    >>> index.longest_prefix_match_bulk(['192.168.3.4', '8.8.8.8'])
+    ['192.168.0.0/16', None]
+    """
+    def __init__(self, network_list=()):
+        parsed = {}
+        for network in network_list:
+            network_int = ipv4_with_prefix_to_int(network)
+            if network_int is None:
+                raise ValueError(f'invalid network: {network}')
+            ip_int, prefix_num = network_int
+            start = ip_int & prefix_to_mask_int(prefix_num)
+            key = (start, start | (0xffffffff >> prefix_num))
+            if key in parsed:
+                parsed[key].append(network)
+            else:
+                parsed[key] = [network]
+        keys = sorted(parsed, key=lambda k: (k[0], -k[1]))
+        self.starts = array('I', [k[0] for k in keys])
+        self.ends = array('I', [k[1] for k in keys])
+        self.networks = [parsed[k] for k in keys]
+        self.parents = array('i', [-1] * len(keys))
+        stack = []
+        for i, (start, end) in enumerate(keys):
+            while stack and self.ends[stack[-1]] < start:
+                stack.pop()
+            if stack:
+                self.parents[i] = stack[-1]
+            stack.append(i)
+
+    def __len__(self):
+        return len(self.networks)
+
+    def find_entry(self, ip_int):
+        i = bisect.bisect_right(self.starts, ip_int) - 1
+        ends = self.ends
+        parents = self.parents
+        while i >= 0 and ends[i] < ip_int:
+            i = parents[i]
+        return i
+
+    def longest_prefix_match(self, ip):
+        ip_int = ipv4_to_int(ip)
+        if ip_int is None:
+            return None
+        i = self.find_entry(ip_int)
+        if i < 0:
+            return None
+        return self.networks[i][0]
+
+    def containing_networks(self, ip):
+        """
+        most specific network first
+        """
+        ip_int = ipv4_to_int(ip)
+        if ip_int is None:
+            return []
+        found = []
+        i = self.find_entry(ip_int)
+        while i >= 0:
+            found += self.networks[i]
+            i = self.parents[i]
+        return found
+
+    def longest_prefix_match_bulk(self, ip_list):
+        return [self.longest_prefix_match(ip) for ip in ip_list]
+
+    def containing_networks_bulk(self, ip_list):
+        return [self.containing_networks(ip) for ip in ip_list]
+
+NETMASK_LIST = [int_to_ipv4(prefix_to_mask_int(prefix_num)) for prefix_num in range(33)]
+NETMASK_PREFIX_DICT = {netmask: str(prefix_num) for prefix_num, netmask in enumerate(NETMASK_LIST)}
+
 def prefix_to_netmask(prefix):
     """
     >>> prefix_to_netmask('16')
@@ -349,23 +1866,17 @@ def prefix_to_netmask(prefix):
     '0.0.0.0'
     >>> prefix_to_netmask('32')
     '255.255.255.255'
+    >>> prefix_to_netmask(24)
+    '255.255.255.0'
+    >>> prefix_to_netmask('33')
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid prefix: 33
     """
-    if re.match(r'\d{1,2}', prefix):
-        int_prefix = int(prefix)
-        if 0 <= int_prefix <= 32:
-            sho = int_prefix // 8
-            mod = int_prefix % 8
-            subnet_mask = ''
-            for i in range(sho):
-                subnet_mask += '.255'
-            for j, k in enumerate(range(4-sho)):
-                if j == 0:
-                    subnet_mask += f'.{mask_list[mod]}'
-                else:
-                    subnet_mask += '.0'
-            return subnet_mask[1:]
-    print_flush(f'err invalid prefix: {prefix}')
-    sys.exit(1)
+    prefix_num = prefix if isinstance(prefix, int) else PREFIX_VALUE_DICT.get(prefix)
+    if prefix_num is None or not 0 <= prefix_num <= 32:
+        raise ValueError(f'invalid prefix: {prefix}')
+    return NETMASK_LIST[prefix_num]
 
 def netmask_to_prefix(netmask):
     """
@@ -378,15 +1889,218 @@ def netmask_to_prefix(netmask):
     >>> netmask_to_prefix('2.255.192.0')
     False
     """
-    if re.match('^' + NETMASK_EXP_STR + '$', netmask):
-        adder = 0
-        for seg in  netmask.split('.'):
-            found_index = find_index_of_value(mask_list, seg)
-            if found_index == -1:
-                return False
-            adder += found_index
-        return str(adder)
-    return False
+    return NETMASK_PREFIX_DICT.get(netmask, False)
+
+def network_address_int(ip_int, prefix_num):
+    return ip_int & prefix_to_mask_int(prefix_num)
+
+def broadcast_address_int(ip_int, prefix_num):
+    return ip_int | (0xffffffff >> prefix_num)
+
+def host_count(prefix_num):
+    """
+    usable hosts, /31 and /32 have no network and broadcast address
+    >>> [host_count(prefix_num) for prefix_num in (16, 24, 30, 31, 32)]
+    [65534, 254, 2, 2, 1]
+    """
+    if prefix_num >= 31:
+        return 2 ** (32 - prefix_num)
+    return 2 ** (32 - prefix_num) - 2
+
+def subnet_ints(network_int, prefix_num, new_prefix_num):
+    """
+    network ints of each new_prefix_num subnet, as a lazy range
+    >>> subnets = subnet_ints(ipv4_to_int('10.0.0.0'), 8, 24)
+    >>> len(subnets)
+    65536
+    >>> int_to_ipv4(subnets[257])
+    '10.1.1.0'
+    """
+    if not prefix_num <= new_prefix_num <= 32:
+        raise ValueError(f'invalid new prefix: {new_prefix_num} for /{prefix_num}')
+    start = network_address_int(network_int, prefix_num)
+    return range(start, broadcast_address_int(start, prefix_num) + 1, 1 << (32 - new_prefix_num))
+
+def iter_subnets(network, new_prefix_num):
+    """
+    >>> list(iter_subnets('192.168.0.0/22', 24))
+    ['192.168.0.0/24', '192.168.1.0/24', '192.168.2.0/24', '192.168.3.0/24']
+    """
+    parsed = ipv4_with_prefix_to_int(network)
+    if parsed is None:
+        raise ValueError(f'invalid network: {network}')
+    for subnet_int in subnet_ints(parsed[0], parsed[1], new_prefix_num):
+        yield f'{int_to_ipv4(subnet_int)}/{new_prefix_num}'
+
+def iter_network_info(network_iter):
+    """
+    yields (network_int, broadcast_int, host_count) per network, None for invalid networks
+    >>> [info for info in iter_network_info(['192.168.1.7/24', 'x'])]
+    [(3232235776, 3232236031, 254), None]
+    """
+    for network in network_iter:
+        parsed = ipv4_with_prefix_to_int(network)
+        if parsed is None:
+            yield None
+            continue
+        ip_int, prefix_num = parsed
+        yield network_address_int(ip_int, prefix_num), broadcast_address_int(ip_int, prefix_num), host_count(prefix_num)
+
+class IPPool:
+    """
+    host addresses of a network are tracked in a bitmap, one bit per host, set when used.
+    network and broadcast addresses are excluded for prefixes up to /30.
+    allocate is amortized O(1): bytes below hint are full except the ones on free_bytes, which release pushes,
+    so a released address is reused before the scan from hint goes on and no full byte is rescanned.
+    >>> pool = IPPool('192.168.10.0', '255.255.255.248')
+    >>> pool.network
+    '192.168.10.0/29'
+    >>> pool.reserve('192.168.10.1', '192.168.10.2')
+    >>> pool.allocate()
+    '192.168.10.3'
+    >>> pool.allocate_many(5)
+    ['192.168.10.4', '192.168.10.5', '192.168.10.6']
+    >>> pool.release('192.168.10.5')
+    True
+    >>> pool.release('192.168.10.1')
+    False
+    >>> pool.allocate()
+    '192.168.10.5'
+    >>> pool.count_free()
+    0
+    """
+    def __init__(self, network, netmask=None):
+        if netmask is not None:
+            prefix = netmask_to_prefix(netmask)
+            if not prefix:
+                raise ValueError(f'invalid netmask: {netmask}')
+            network = f'{network}/{prefix}'
+        parsed = ipv4_with_prefix_to_int(network)
+        if parsed is None:
+            raise ValueError(f'invalid network: {network}')
+        ip_int, prefix_num = parsed
+        self.prefix = prefix_num
+        self.network_int = network_address_int(ip_int, prefix_num)
+        self.network = f'{int_to_ipv4(self.network_int)}/{prefix_num}'
+        self.size = host_count(prefix_num)
+        self.first_int = self.network_int if prefix_num >= 31 else self.network_int + 1
+        self.used = bytearray((self.size + 7) // 8)
+        self.reserved = bytearray(len(self.used))
+        # bits past the last host are marked used so allocate never returns them
+        for index in range(self.size, len(self.used) * 8):
+            self.used[index >> 3] |= 1 << (index & 7)
+        self.used_count = 0
+        self.hint = 0
+        self.free_bytes = []
+
+    def to_index(self, ip):
+        ip_int = ipv4_to_int(ip)
+        if ip_int is None:
+            raise ValueError(f'invalid ip: {ip}')
+        index = ip_int - self.first_int
+        if not 0 <= index < self.size:
+            raise ValueError(f'ip {ip} is not a host of {self.network}')
+        return index
+
+    def is_used(self, ip):
+        index = self.to_index(ip)
+        return bool(self.used[index >> 3] & (1 << (index & 7)))
+
+    def count_used(self):
+        return self.used_count
+
+    def count_free(self):
+        return self.size - self.used_count
+
+    def allocate(self):
+        used = self.used
+        free_bytes = self.free_bytes
+        while free_bytes:
+            byte_index = free_bytes[-1]
+            byte = used[byte_index]
+            if byte == 0xff:
+                # filled meanwhile by allocate or reserve
+                free_bytes.pop()
+                continue
+            bit = ~byte & (byte + 1)
+            used[byte_index] = byte | bit
+            if byte | bit == 0xff:
+                free_bytes.pop()
+            self.used_count += 1
+            return int_to_ipv4(self.first_int + (byte_index << 3) + bit.bit_length() - 1)
+        for byte_index in range(self.hint, len(used)):
+            byte = used[byte_index]
+            if byte != 0xff:
+                bit = ~byte & (byte + 1)
+                used[byte_index] = byte | bit
+                self.hint = byte_index
+                self.used_count += 1
+                return int_to_ipv4(self.first_int + (byte_index << 3) + bit.bit_length() - 1)
+        self.hint = len(used)
+        return None
+
+    def allocate_many(self, count):
+        allocated = []
+        for i in range(count):
+            ip = self.allocate()
+            if ip is None:
+                break
+            allocated.append(ip)
+        return allocated
+
+    def release(self, ip):
+        index = self.to_index(ip)
+        byte_index, bit = index >> 3, 1 << (index & 7)
+        byte = self.used[byte_index]
+        if self.reserved[byte_index] & bit or not byte & bit:
+            return False
+        self.used[byte_index] = byte & ~bit
+        self.used_count -= 1
+        # a byte below hint which wasn't full is on free_bytes already
+        if byte_index < self.hint and byte == 0xff:
+            self.free_bytes.append(byte_index)
+        return True
+
+    def reserve(self, start_ip, end_ip=None):
+        start = self.to_index(start_ip)
+        end = self.to_index(end_ip) if end_ip else start
+        for index in range(start, end + 1):
+            byte_index, bit = index >> 3, 1 << (index & 7)
+            if not self.used[byte_index] & bit:
+                self.used_count += 1
+            self.used[byte_index] |= bit
+            self.reserved[byte_index] |= bit
+
+    def to_dict(self):
+        import base64
+        return {
+            'network': self.network
+            , 'used': base64.b64encode(self.used).decode()
+            , 'reserved': base64.b64encode(self.reserved).decode()
+        }
+
+    def save(self, file_path):
+        return write_json(file_path, self.to_dict(), indent=None)
+
+    @classmethod
+    def from_dict(cls, pool_dict):
+        import base64
+        pool = cls(pool_dict['network'])
+        used = bytearray(base64.b64decode(pool_dict['used']))
+        reserved = bytearray(base64.b64decode(pool_dict['reserved']))
+        if len(used) != len(pool.used) or len(reserved) != len(pool.reserved):
+            raise ValueError(f'bitmap size mismatch for {pool.network}')
+        pool.used = used
+        pool.reserved = reserved
+        pool.used_count = sum(bin(byte).count('1') for byte in used) - (len(used) * 8 - pool.size)
+        return pool
+
+    @classmethod
+    def load(cls, file_path):
+        loaded_json = read_json(file_path)
+        if not loaded_json:
+            return None
+        return cls.from_dict(loaded_json)
 
 def find(item_list, func):
     """
@@ -395,10 +2109,7 @@ def find(item_list, func):
     >>> find(['melon', 'apple', 'mapple'], lambda item: re.search('ringo', item))
     False
     """
-    for item in item_list:
-        if func(item):
-            return item
-    return False
+    return pipeline.find(item_list, func, False)
 
 def find_index(item_list, func):
     """
@@ -422,17 +2133,10 @@ def filter(item_list, func):
     >>> filter(['apple', 'linux', 'windows'], lambda item: item != 'linux')
     ['apple', 'windows']
     """
-    filtered = []
-    for item in item_list:
-        if func(item):
-            filtered.append(item)
-    return filtered
+    return list(pipeline.filter(item_list, func))
 
 def map(item_list, func):
-    new_list_obj = []
-    for item in item_list:
-        new_list_obj.append(func(item))
-    return new_list_obj
+    return list(pipeline.map(item_list, func))
 
 def concat_dict(args):
     """
@@ -441,11 +2145,103 @@ def concat_dict(args):
     >>> c = {'c': 'this is c'}
     >>> concat_dict([a, b, c])
     {'a': 'this is a', 'b': 'this is b', 'c': 'this is c'}
+    >>> concat_dict([{1: 'one', 'a': 'old'}, {'a': 'new'}])
+    {1: 'one', 'a': 'new'}
+    >>> concat_dict([])
+    {}
     """
-    x = args[0]
-    if len(args) == 1:
-        return x
-    return dict(x, **concat_dict(args[1:]))
+    concatenated = {}
+    for x in args:
+        concatenated.update(x)
+    return concatenated
+
+def deep_merge_into(base, override, owned_ids):
+    for k, v in override.items():
+        current = base.get(k)
+        if isinstance(v, dict) and isinstance(current, dict):
+            if id(current) not in owned_ids:
+                current = dict(current)
+                owned_ids.add(id(current))
+                base[k] = current
+            deep_merge_into(current, v, owned_ids)
+        else:
+            base[k] = v
+
+def deep_merge(args):
+    """
+    later dicts override earlier ones, nested dicts are merged key by key.
+    sub dicts only one layer has are shared with that layer, not copied, so copy before mutating the result.
+    >>> base = {'server': {'host': 'localhost', 'port': 80}, 'users': {'root': {'shell': 'bash'}}}
+    >>> override = {'server': {'port': 8080}, 'debug': True}
+    >>> merged = deep_merge([base, override])
+    >>> merged
+    {'server': {'host': 'localhost', 'port': 8080}, 'users': {'root': {'shell': 'bash'}}, 'debug': True}
+    >>> base['server']['port'], merged['users'] is base['users']
+    (80, True)
+    """
+    merged = {}
+    owned_ids = {id(merged)}
+    for x in args:
+        deep_merge_into(merged, x, owned_ids)
+    return merged
+
+class LayeredConfig(Mapping):
+    """
+    read only ChainMap-like view deep merging layers lazily, the last layer has the highest priority.
+    a nested dict is returned as a LayeredConfig over the same layers, nothing is copied until to_dict.
+    >>> config = LayeredConfig([{'server': {'host': 'localhost', 'port': 80}}, {'server': {'port': 8080}}])
+    >>> config['server']['port'], config['server']['host']
+    (8080, 'localhost')
+    >>> config.push({'server': {'host': 'example.com'}}).to_dict()
+    {'server': {'host': 'example.com', 'port': 8080}}
+    """
+    def __init__(self, layers=()):
+        self.layers = list(layers)
+
+    def push(self, layer):
+        self.layers.append(layer)
+        return self
+
+    def __getitem__(self, key):
+        found = []
+        for layer in reversed(self.layers):
+            if key in layer:
+                value = layer[key]
+                if not isinstance(value, Mapping):
+                    if found:
+                        break
+                    return value
+                found.append(value)
+        if not found:
+            raise KeyError(key)
+        if len(found) == 1:
+            return found[0]
+        found.reverse()
+        return LayeredConfig(found)
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return f'LayeredConfig({self.layers!r})'
+
+    def to_dict(self):
+        return deep_merge([layer.to_dict() if isinstance(layer, LayeredConfig) else layer for layer in self.layers])
+
+def read_toml_layers(file_path_list):
+    """
+    LayeredConfig of toml files, later files override earlier ones, unreadable files are skipped
+    """
+    layers = [read_toml(file_path) for file_path in file_path_list]
+    return LayeredConfig(layer for layer in layers if layer is not False)
 
 def hex_mac_kvm():
     import random
@@ -459,11 +2255,100 @@ def MACprettyprint(mac):
     >>> MACprettyprint([0x52, 0x54, 0x00, 0x00, 0x00, 0x00])
     '52:54:00:00:00:00'
     """
-    return ':'.join(map(mac, lambda x: "%02x" % x))
+    return ':'.join(["%02x" % x for x in mac])
 
 def random_mac():
     return MACprettyprint(hex_mac_kvm())
 
+KVM_MAC_EXP = re.compile(r'52:54:00:([0-9a-fA-F]{2}):([0-9a-fA-F]{2}):([0-9a-fA-F]{2})')
+
+class KvmMacAllocator:
+    """
+    unique 52:54:00:xx:xx:xx addresses, the 24 bit suffixes in use are kept in a 2MiB bitmap.
+    seed makes the allocation order reproducible.
+    >>> allocator = KvmMacAllocator(['52:54:00:00:00:01'], seed=1)
+    >>> allocator.is_used('52:54:00:00:00:01')
+    True
+    >>> mac_list = allocator.allocate(1000)
+    >>> len(set(mac_list)), '52:54:00:00:00:01' in mac_list
+    (1000, False)
+    >>> KvmMacAllocator(seed=1).allocate(2) == KvmMacAllocator(seed=1).allocate(2)
+    True
+    """
+    SIZE = 1 << 24
+
+    def __init__(self, used_mac_list=(), seed=None):
+        import random
+        self.random = random.Random(seed)
+        self.used = bytearray(self.SIZE // 8)
+        self.used_count = 0
+        for mac in used_mac_list:
+            self.mark_used(mac)
+
+    @staticmethod
+    def to_suffix(mac):
+        m = KVM_MAC_EXP.fullmatch(mac.strip())
+        if not m:
+            return None
+        return int(m[1] + m[2] + m[3], 16)
+
+    @staticmethod
+    def to_mac(suffix):
+        return f'52:54:00:{suffix >> 16:02x}:{suffix >> 8 & 255:02x}:{suffix & 255:02x}'
+
+    def set_used(self, suffix):
+        byte_index, bit = suffix >> 3, 1 << (suffix & 7)
+        if self.used[byte_index] & bit:
+            return False
+        self.used[byte_index] |= bit
+        self.used_count += 1
+        return True
+
+    def mark_used(self, mac):
+        """
+        returns False for a mac outside 52:54:00 or already marked
+        """
+        suffix = self.to_suffix(mac)
+        if suffix is None:
+            return False
+        return self.set_used(suffix)
+
+    def load_used(self, file_path):
+        """
+        marks every 52:54:00 mac found in the file, e.g. a list or a virsh dumpxml output
+        """
+        data = open_read(file_path)
+        if data is False:
+            return False
+        for m in KVM_MAC_EXP.finditer(data):
+            self.set_used(int(m[1] + m[2] + m[3], 16))
+        return True
+
+    def is_used(self, mac):
+        suffix = self.to_suffix(mac)
+        return suffix is not None and bool(self.used[suffix >> 3] & (1 << (suffix & 7)))
+
+    def count_free(self):
+        return self.SIZE - self.used_count
+
+    def allocate(self, count=1):
+        if count > self.count_free():
+            raise ValueError(f'only {self.count_free()} kvm macs are free, {count} requested')
+        getrandbits = self.random.getrandbits
+        allocated = []
+        while len(allocated) < count:
+            if self.used_count * 10 > self.SIZE * 9:
+                # random draws mostly collide when this full, scan from a random point instead
+                suffix = getrandbits(24)
+                while not self.set_used(suffix):
+                    suffix = (suffix + 1) % self.SIZE
+                allocated.append(self.to_mac(suffix))
+                continue
+            suffix = getrandbits(24)
+            if self.set_used(suffix):
+                allocated.append(self.to_mac(suffix))
+        return allocated
+
 def write_file_list(file_list):
     for item in file_list:
         filepath = item[0]
@@ -472,3 +2357,58 @@ def write_file_list(file_list):
         if re.search(r'.+\.sh$', filepath):
             st = os.stat(filepath)
             os.chmod(filepath, st.st_mode | stat.S_IEXEC)
+
+def write_file_if_changed(file_path, contents, file_mode):
+    """
+    file_mode is used when the file is created, umask applies as with open
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        st = None
+    if st is not None:
+        if file_mode & stat.S_IEXEC and not st.st_mode & stat.S_IEXEC:
+            os.chmod(file_path, st.st_mode | stat.S_IEXEC)
+        if st.st_size == len(contents):
+            with open(file_path, 'rb') as f:
+                if f.read() == contents:
+                    return 'unchanged'
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, file_mode)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+    return 'written'
+
+def write_file_list_bulk(file_list, max_workers=8, encoding='utf-8'):
+    """
+    write_file_list through a thread pool. parent dirs are made once, .sh files are created executable,
+    and files whose contents are unchanged are not rewritten.
+    returns a report per item in order: {'path', 'status': 'written'|'unchanged'|'error', 'error'}
+    >>> report = write_file_list_bulk([('/tmp/write_file_list_bulk/a.sh', 'echo a'), ('/tmp/write_file_list_bulk/b.txt', 'b')])
+    >>> [item['status'] for item in write_file_list_bulk([('/tmp/write_file_list_bulk/a.sh', 'echo a'), ('/tmp/write_file_list_bulk/b.txt', 'bb')])]
+    ['unchanged', 'written']
+    >>> os.access('/tmp/write_file_list_bulk/a.sh', os.X_OK)
+    True
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    report = [{'path': item[0], 'status': None, 'error': None} for item in file_list]
+    dir_set = {os.path.dirname(item[0]) for item in file_list}
+    for dir_path in dir_set:
+        if dir_path:
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except OSError:
+                # reported per file when its write fails
+                pass
+    def write(index):
+        file_path, contents = file_list[index][0], file_list[index][1]
+        if isinstance(contents, str):
+            contents = contents.encode(encoding)
+        file_mode = 0o666 | stat.S_IEXEC if len(file_path) > 3 and file_path.endswith('.sh') else 0o666
+        try:
+            report[index]['status'] = write_file_if_changed(file_path, contents, file_mode)
+        except Exception as e:
+            report[index]['status'] = 'error'
+            report[index]['error'] = str(e)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(write, range(len(file_list))))
+    return report
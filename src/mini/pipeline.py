@@ -0,0 +1,117 @@
+"""
+lazy counterparts of misc.find / filter / map, taking (item_list, func) in the same order.
+stages are generators, so chaining them builds no intermediate list and find / take stop the upstream early.
+>>> Pipeline(range(10 ** 9)).map(lambda n: n * n).filter(lambda n: n % 3 == 0).take(4).list()
+[0, 9, 36, 81]
+"""
+import itertools
+from collections import deque
+
+def map(item_list, func):
+    """
+    >>> list(map([1, 2, 3], lambda n: n * 10))
+    [10, 20, 30]
+    """
+    for item in item_list:
+        yield func(item)
+
+def filter(item_list, func):
+    """
+    >>> list(filter(['apple', 'linux', 'windows'], lambda item: item != 'linux'))
+    ['apple', 'windows']
+    """
+    for item in item_list:
+        if func(item):
+            yield item
+
+def take(item_list, count):
+    """
+    >>> list(take(itertools.count(), 3))
+    [0, 1, 2]
+    """
+    return itertools.islice(item_list, count)
+
+def chunk(item_list, size):
+    """
+    >>> list(chunk(range(7), 3))
+    [[0, 1, 2], [3, 4, 5], [6]]
+    """
+    it = iter(item_list)
+    while True:
+        chunked = list(itertools.islice(it, size))
+        if not chunked:
+            return
+        yield chunked
+
+def find(item_list, func, default=None):
+    """
+    returns default when nothing matches, so a falsy item can be told from no match
+    >>> find([3, 0, 5], lambda n: n < 1)
+    0
+    >>> find([3, 5], lambda n: n < 1) is None
+    True
+    """
+    for item in item_list:
+        if func(item):
+            return item
+    return default
+
+def parallel_map(item_list, func, max_workers=None, use_process=False, max_in_flight=None):
+    """
+    map over a thread pool, or a process pool with use_process=True, yielding results in input order.
+    at most max_in_flight items (default 2 * workers) are submitted ahead of the consumer.
+    with a process pool, func and the items have to be picklable.
+    >>> list(parallel_map(range(5), abs, max_workers=2))
+    [0, 1, 2, 3, 4]
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = max_workers * 2
+    executor_class = ProcessPoolExecutor if use_process else ThreadPoolExecutor
+    with executor_class(max_workers=max_workers) as executor:
+        in_flight = deque()
+        try:
+            for item in item_list:
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+                in_flight.append(executor.submit(func, item))
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            # consumer stopped early, don't run what it won't read
+            for future in in_flight:
+                future.cancel()
+
+class Pipeline:
+    """
+    fluent chaining of the stages above, nothing runs until the pipeline is iterated
+    """
+    def __init__(self, item_list):
+        self.item_list = item_list
+
+    def __iter__(self):
+        return iter(self.item_list)
+
+    def map(self, func):
+        return Pipeline(map(self.item_list, func))
+
+    def filter(self, func):
+        return Pipeline(filter(self.item_list, func))
+
+    def take(self, count):
+        return Pipeline(take(self.item_list, count))
+
+    def chunk(self, size):
+        return Pipeline(chunk(self.item_list, size))
+
+    def parallel_map(self, func, max_workers=None, use_process=False, max_in_flight=None):
+        return Pipeline(parallel_map(self.item_list, func, max_workers, use_process, max_in_flight))
+
+    def find(self, func, default=None):
+        return find(self.item_list, func, default)
+
+    def list(self):
+        return list(self.item_list)
@@ -0,0 +1,311 @@
+"""
+runs named tasks on a bounded pool of processes or threads.
+each task prints to the create_log_params paths of its name, holds a FileLock while it runs when lock_dir_path
+is given, and is terminated (process) or abandoned (thread) after its timeout.
+>>> log_base_params = {'log_parent_dir': '/tmp/runner_test', 'task_name': 'doctest', 'enable_output': False}
+>>> results = run_tasks([('a', print, ('hello',)), ('b', int, ('x',))], log_base_params, max_workers=2, summary=False)
+>>> [(result.name, result.status) for result in results]
+[('a', 'ok'), ('b', 'failed')]
+>>> misc.open_read('/tmp/runner_test/logs_doctest/a/output.log')
+'hello\\n'
+"""
+import os
+import sys
+import time
+from collections import namedtuple
+from . import misc
+from . import ansi_colors
+
+Task = namedtuple('Task', 'name func args timeout', defaults=((), None))
+TaskResult = namedtuple('TaskResult', 'name status duration result error log_dir')
+
+class ThreadLocalWriter:
+    """
+    stands in for sys.stdout or sys.stderr while tasks run on threads, each thread writes to its own stream
+    """
+    def __init__(self, fallback):
+        import threading
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def set_stream(self, stream):
+        self.local.stream = stream
+
+    def get_stream(self):
+        return getattr(self.local, 'stream', None) or self.fallback
+
+    def write(self, s):
+        return self.get_stream().write(s)
+
+    def flush(self):
+        return self.get_stream().flush()
+
+    def isatty(self):
+        return False
+
+def open_task_logs(log_params, append):
+    """
+    returns (output writer, debug writer) on the output.log and debug.log paths of log_params
+    """
+    if append:
+        output_path = log_params['output_log_append_path']
+        debug_path = log_params['debug_log_append_path']
+    else:
+        output_path = log_params['output_log_file_path']
+        debug_path = log_params['debug_log_file_path']
+    write_mode = 'a' if append or log_params.get('dont_truncate') else 'w'
+    tee = sys.__stdout__ if log_params['enable_stdout'] else None
+    output = misc.ForkWriter(output_path, write_mode, tee=tee)
+    debug = misc.ForkWriter(debug_path, write_mode, strip_ansi=not log_params.get('debug_color', True))
+    return output, debug
+
+def task_entry(result_queue, task, log_params, append, thread_writers=None):
+    """
+    runs in the worker, stdout goes to output.log and stderr with tracebacks to debug.log.
+    thread_writers is the ThreadLocalWriter pair installed as sys.stdout and sys.stderr when running on threads
+    """
+    import traceback
+    output, debug = open_task_logs(log_params, append)
+    if thread_writers:
+        thread_writers[0].set_stream(output)
+        thread_writers[1].set_stream(debug)
+    else:
+        sys.stdout, sys.stderr = output, debug
+    result = None
+    error = None
+    try:
+        result = task.func(*task.args)
+        status = 'ok'
+    except BaseException as e:
+        status = 'failed'
+        error = repr(e)
+        debug.write(traceback.format_exc())
+    finally:
+        if thread_writers:
+            thread_writers[0].set_stream(None)
+            thread_writers[1].set_stream(None)
+        else:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        output.close()
+        debug.close()
+    if not thread_writers:
+        import pickle
+        try:
+            pickle.dumps(result)
+        except Exception:
+            result = repr(result)
+    result_queue.put((task.name, status, result, error))
+
+class StreamGuard:
+    """
+    keeps the ThreadLocalWriter pair installed until run_tasks returns and every abandoned thread has ended,
+    so what an abandoned thread prints still goes to its output.log, other threads fall back to the originals
+    """
+    def __init__(self, thread_writers, originals):
+        import threading
+        self.thread_writers = thread_writers
+        self.originals = originals
+        self.lock = threading.Lock()
+        # run_tasks itself is the first holder
+        self.holders = 1
+
+    def hold(self):
+        with self.lock:
+            self.holders += 1
+
+    def release(self):
+        with self.lock:
+            self.holders -= 1
+            if self.holders:
+                return
+        for stream_name, writer, original in zip(('stdout', 'stderr'), self.thread_writers, self.originals):
+            if getattr(sys, stream_name) is writer:
+                setattr(sys, stream_name, original)
+
+def watch_abandoned(worker, lock, lock_ttl, stream_guard):
+    """
+    keeps the lock of an abandoned thread refreshed until the thread ends, so the task can't start elsewhere meanwhile,
+    then releases the lock and its hold on the streams
+    """
+    import threading
+    stream_guard.hold()
+    def watch():
+        try:
+            while worker.is_alive():
+                worker.join(lock_ttl / 3)
+                if lock:
+                    lock.refresh()
+            if lock:
+                lock.release()
+        finally:
+            stream_guard.release()
+    threading.Thread(target=watch, name=f'watch_abandoned {worker.name}', daemon=True).start()
+
+def run_tasks(task_list, log_base_params, max_workers=None, use_process=False, timeout=None, lock_dir_path=None, lock_ttl=300, append=False, summary=True):
+    """
+    task_list: Task or (name, func, args[, timeout]) items, names are unique as they name the log dirs
+    log_base_params: create_log_params base, {'log_parent_dir', 'task_name', 'enable_output'}
+    timeout: default seconds per task, a process is terminated and a thread left running unobserved,
+        the lock of such a thread stays held and its output still goes to its logs until it ends
+    lock_dir_path: a task whose lock is held elsewhere is skipped with status 'locked'
+    with use_process the start method of multiprocessing applies, func and args may need to be picklable.
+    returns TaskResult items in task_list order, status is 'ok', 'failed', 'timeout' or 'locked'
+    """
+    import queue
+    task_list = [task if isinstance(task, Task) else Task(*task) for task in task_list]
+    name_list = [task.name for task in task_list]
+    if len(set(name_list)) != len(name_list):
+        raise ValueError('task names must be unique')
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    thread_writers = None
+    stream_guard = None
+    if use_process:
+        import multiprocessing
+        result_queue = multiprocessing.Queue()
+    else:
+        import threading
+        result_queue = queue.Queue()
+        stdout, stderr = sys.stdout, sys.stderr
+        thread_writers = (ThreadLocalWriter(stdout), ThreadLocalWriter(stderr))
+        sys.stdout, sys.stderr = thread_writers
+        stream_guard = StreamGuard(thread_writers, (stdout, stderr))
+    results = {}
+    running = {}
+    pending = list(reversed(task_list))
+    wall_start = time.perf_counter()
+    last_refresh = time.monotonic()
+
+    def finish(name, status, result=None, error=None):
+        worker, lock, start, deadline, log_dir = running.pop(name)
+        if not use_process and worker.is_alive():
+            watch_abandoned(worker, lock, lock_ttl, stream_guard)
+        elif lock:
+            lock.release()
+        if use_process:
+            worker.join(1)
+        results[name] = TaskResult(name, status, time.perf_counter() - start, result, error, log_dir)
+
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                task = pending.pop()
+                log_params = misc.create_log_params(task.name, log_base_params, append)
+                lock = None
+                if lock_dir_path:
+                    lock = misc.FileLock(lock_dir_path, f'{log_base_params["task_name"]}_{misc.sanitize_to_file_name(task.name)}', ttl=lock_ttl)
+                    if not lock.try_acquire():
+                        results[task.name] = TaskResult(task.name, 'locked', 0.0, None, f'locked: {lock.lock_file_path}', log_params['log_dir'])
+                        continue
+                args = (result_queue, task, log_params, append, thread_writers)
+                if use_process:
+                    worker = multiprocessing.Process(target=task_entry, args=args, daemon=True)
+                else:
+                    worker = threading.Thread(target=task_entry, args=args, daemon=True)
+                task_timeout = timeout if task.timeout is None else task.timeout
+                deadline = None if task_timeout is None else time.monotonic() + task_timeout
+                running[task.name] = (worker, lock, time.perf_counter(), deadline, log_params['log_dir'])
+                worker.start()
+            if not running:
+                continue
+            # processes are polled so a crashed one is noticed
+            wait = 0.5 if use_process else lock_ttl / 3
+            deadline_list = [deadline for worker, lock, start, deadline, log_dir in running.values() if deadline is not None]
+            if deadline_list:
+                wait = max(0.0, min(wait, min(deadline_list) - time.monotonic()))
+            try:
+                name, status, result, error = result_queue.get(timeout=wait)
+                # late results of abandoned threads are dropped
+                if name in running:
+                    finish(name, status, result, error)
+                continue
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            for name, (worker, lock, start, deadline, log_dir) in list(running.items()):
+                if deadline is not None and now >= deadline:
+                    if use_process:
+                        worker.terminate()
+                    finish(name, 'timeout', error=f'timed out after {time.perf_counter() - start:.1f}s')
+                elif use_process and not worker.is_alive():
+                    # the result may still be in the queue, it was put before the process exited
+                    try:
+                        late_name, status, result, error = result_queue.get(timeout=0.1)
+                        if late_name in running:
+                            finish(late_name, status, result, error)
+                    except queue.Empty:
+                        finish(name, 'failed', error=f'exit code {worker.exitcode}')
+            if lock_dir_path and now - last_refresh >= lock_ttl / 3:
+                for worker, lock, start, deadline, log_dir in running.values():
+                    lock.refresh()
+                last_refresh = now
+    finally:
+        for name in list(running):
+            worker = running[name][0]
+            if use_process:
+                worker.terminate()
+            finish(name, 'failed', error='runner stopped')
+        if stream_guard:
+            stream_guard.release()
+    result_list = [results[name] for name in name_list]
+    if summary:
+        print_summary(result_list, time.perf_counter() - wall_start)
+    return result_list
+
+STATUS_COLOR = {
+    'ok': ansi_colors.green
+    , 'failed': ansi_colors.red
+    , 'timeout': ansi_colors.red
+    , 'locked': ansi_colors.yellow
+}
+
+def format_summary(result_list, wall_seconds=None):
+    """
+    >>> print(format_summary([TaskResult('a', 'ok', 1.5, None, None, '/tmp/a')], 1.5))
+    a     ok         1.500s  /tmp/a
+    1 tasks: ok 1, wall 1.500s, sum 1.500s
+    """
+    width = max([len(result.name) for result in result_list] + [4])
+    line_list = []
+    count_dict = {}
+    for result in result_list:
+        count_dict[result.status] = count_dict.get(result.status, 0) + 1
+        line = f'{result.name:{width + 2}}{result.status:8}{result.duration:8.3f}s  {result.log_dir}'
+        if result.error:
+            line += f'  {result.error}'
+        line_list.append(line)
+    total = f'{len(result_list)} tasks: ' + ', '.join(f'{status} {count}' for status, count in count_dict.items())
+    if wall_seconds is not None:
+        total += f', wall {wall_seconds:.3f}s'
+    total += f', sum {sum(result.duration for result in result_list):.3f}s'
+    line_list.append(total)
+    return '\n'.join(line_list)
+
+def print_summary(result_list, wall_seconds=None):
+    line_list = format_summary(result_list, wall_seconds).split('\n')
+    for result, line in zip(result_list, line_list):
+        misc.print_flush(STATUS_COLOR[result.status](line))
+    misc.print_flush(line_list[-1])
+
+def test_runner(process_num=4):
+    """
+    sleeps that take one second each must finish in about one second on process_num processes,
+    the one exceeding its timeout must be terminated and a task locked elsewhere must be skipped
+    """
+    log_base_params = {'log_parent_dir': '/tmp/runner_test', 'task_name': 'test_runner', 'enable_output': False}
+    lock_dir_path = '/tmp/runner_test/lock'
+    held = misc.FileLock(lock_dir_path, 'test_runner_held')
+    held.try_acquire()
+    task_list = [Task(f'sleep_{i}', time.sleep, (1,)) for i in range(process_num)]
+    task_list.append(Task('slow', time.sleep, (30,), timeout=0.5))
+    task_list.append(Task('held', time.sleep, (0,)))
+    start = time.perf_counter()
+    try:
+        result_list = run_tasks(task_list, log_base_params, max_workers=process_num + 2, use_process=True, lock_dir_path=lock_dir_path)
+    finally:
+        held.release()
+    elapsed = time.perf_counter() - start
+    status_list = [result.status for result in result_list]
+    ok = status_list == ['ok'] * process_num + ['timeout', 'locked'] and elapsed < 2
+    misc.print_flush((ansi_colors.green if ok else ansi_colors.red)(f'test_runner: {status_list} in {elapsed:.3f}s'))
+    return ok